@@ -23,43 +23,257 @@
 # Риск создания циклических зависимостей
 
 
+import asyncio
+import random
+import time
+import weakref
 from abc import ABC, abstractmethod
-from typing import Optional, Any
+from itertools import islice
+from typing import Optional, Any, Dict, Iterable, Iterator, List, Tuple
 
 
 class Handler(ABC):
     """
     Абстрактный обработчик.
+
+    Обработчик может объявить в ``keys`` ключи, которые он обрабатывает
+    по точному совпадению. Такие обработчики попадают в хеш-индекс
+    цепочки (см. ``dispatch``) и вызываются только для своих ключей.
+    Обработчики без ``keys`` проверяются по порядку, как и раньше.
+
+    Подкласс определяет ``process`` (только своя проверка) или, как
+    раньше, ``handle`` целиком с передачей дальше через ``_handle_next``.
+    Такое звено непрозрачно для ``dispatch`` и ``handle_many``: они
+    доходят до него по таблице и отдают ему запрос через ``handle``.
     """
 
+    keys: Tuple[Any, ...] = ()
+
+    # Трассировщик звена, None - трассировка выключена.
+    _tracer: Optional["ChainTracer"] = None
+
     def __init__(self):
+        if (type(self).process is Handler.process
+                and type(self).handle is Handler.handle):
+            raise TypeError(f"{type(self).__name__} должен определить "
+                            "process или handle")
         self._next_handler: Optional[Handler] = None
+        self._table: Optional[_DispatchTable] = None
+        # Скомпилированные таблицы цепочек, в которые входит звено.
+        self._dependents: "weakref.WeakSet[_DispatchTable]" = weakref.WeakSet()
 
     def set_next(self, handler: "Handler") -> "Handler":
         self._next_handler = handler
+        # Сбрасываются только таблицы цепочек, проходящих через это звено.
+        for table in self._dependents:
+            table.valid = False
+        self._dependents.clear()
         return handler
 
-    @abstractmethod
+    @property
+    def _opaque(self) -> bool:
+        """Звено переопределяет handle, а не process."""
+        return type(self).process is Handler.process
+
     def handle(self, request: Any) -> Optional[str]:
-        pass
+        if self._tracer is None:
+            result = self.process(request)
+        else:
+            result = self._tracer.trace(self, request)
+        if result is None:
+            return self._handle_next(request)
+        return result
+
+    def process(self, request: Any) -> Optional[str]:
+        """Обработать запрос только этим звеном, без передачи дальше."""
+        raise NotImplementedError(
+            f"{type(self).__name__} переопределяет handle, а не process")
+
+    def process_batch(self, requests: List[Any]) -> List[Optional[str]]:
+        """Обработать пачку запросов этим звеном, None - не обработан."""
+        return [self.process(request) for request in requests]
 
     def _handle_next(self, request: Any) -> Optional[str]:
         if self._next_handler:
             return self._next_handler.handle(request)
         return None
 
+    def set_tracer(self, tracer: Optional["ChainTracer"]) -> None:
+        """Подключает трассировщик ко всем звеньям цепочки (None - отключает)."""
+        for handler in self.chain():
+            handler._tracer = tracer
+
+    def chain(self) -> List["Handler"]:
+        """Возвращает звенья цепочки начиная с текущего."""
+        handlers = []
+        seen = set()
+        handler = self
+        while handler is not None:
+            if id(handler) in seen:
+                raise ValueError("Цепочка обработчиков содержит цикл")
+            seen.add(id(handler))
+            handlers.append(handler)
+            handler = handler._next_handler
+        return handlers
+
+    def _compiled(self) -> "_DispatchTable":
+        table = self._table
+        if table is None or not table.valid:
+            table = self._table = _DispatchTable(self.chain())
+            for handler in table.handlers:
+                handler._dependents.add(table)
+            if table.tail is not None:
+                table.tail._dependents.add(table)
+        return table
+
+    def dispatch(self, request: Any) -> Optional[str]:
+        """
+        Обрабатывает запрос через скомпилированную таблицу цепочки.
+
+        Результат совпадает с ``handle``: ключевой обработчик находится
+        за O(1), а обработчики-предикаты, стоящие в цепочке раньше него,
+        по-прежнему получают запрос первыми.
+        """
+        table = self._compiled()
+        try:
+            position = table.index.get(request, table.size)
+        except TypeError:
+            # Нехешируемый запрос не может совпасть с ключом.
+            position = table.size
+
+        for fallback_position, handler in table.fallback:
+            if fallback_position > position:
+                break
+            if handler._tracer is None:
+                result = handler.process(request)
+            else:
+                result = handler._tracer.trace(handler, request)
+            if result is not None:
+                return result
+
+        if position < table.size:
+            # Ключевой обработчик может отказаться - тогда продолжаем линейно.
+            for handler in islice(table.handlers, position, table.size):
+                if handler.keys and request not in handler.keys:
+                    continue
+                if handler._tracer is None:
+                    result = handler.process(request)
+                else:
+                    result = handler._tracer.trace(handler, request)
+                if result is not None:
+                    return result
+        if table.tail is not None:
+            return table.tail.handle(request)
+        return None
+
+    def handle_many(self, requests: Iterable[Any]) -> List[Optional[str]]:
+        """
+        Обрабатывает запросы пачкой, сохраняя порядок результатов.
+
+        Пачка проходит цепочку по звеньям: каждое забирает свои запросы,
+        остальные одной пачкой уходят дальше. Ключевые звенья получают
+        только запросы со своими ключами, без перебора всей пачки.
+        """
+        requests = list(requests)
+        results: List[Optional[str]] = [None] * len(requests)
+        # Ожидающие запросы сгруппированы по ключу, нехешируемые - отдельно.
+        by_key: Dict[Any, List[int]] = {}
+        loose: List[int] = []
+        for i, request in enumerate(requests):
+            try:
+                by_key.setdefault(request, []).append(i)
+            except TypeError:
+                loose.append(i)
+
+        table = self._compiled()
+        for handler in table.handlers:
+            if not by_key and not loose:
+                break
+            if handler.keys:
+                pending = []
+                for key in handler.keys:
+                    pending.extend(by_key.pop(key, ()))
+                pending.sort()
+            else:
+                pending = sorted(loose + [i for group in by_key.values()
+                                          for i in group])
+                by_key = {}
+                loose = []
+            if not pending:
+                continue
+
+            batch = [requests[i] for i in pending]
+            if handler._tracer is None:
+                answers = handler.process_batch(batch)
+            else:
+                answers = handler._tracer.trace_batch(handler, batch)
+            for i, answer in zip(pending, answers):
+                if answer is not None:
+                    results[i] = answer
+                    continue
+                try:
+                    by_key.setdefault(requests[i], []).append(i)
+                except TypeError:
+                    loose.append(i)
+
+        if table.tail is not None:
+            for i in sorted(loose + [i for group in by_key.values()
+                                     for i in group]):
+                results[i] = table.tail.handle(requests[i])
+        return results
+
+    def handle_stream(self, requests: Iterable[Any],
+                      batch_size: int = 1024) -> Iterator[Optional[str]]:
+        """Лениво обрабатывает поток запросов пачками по batch_size."""
+        iterator = iter(requests)
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                return
+            yield from self.handle_many(batch)
+
+
+class _DispatchTable:
+    """
+    Скомпилированная цепочка: индекс ключей и список предикатов.
+
+    Таблица покрывает звенья до первого непрозрачного (с собственным
+    ``handle``); оно хранится в ``tail`` и обрабатывает остаток цепочки.
+    """
+
+    def __init__(self, handlers: List[Handler]):
+        self.valid = True
+        self.tail: Optional[Handler] = None
+        for position, handler in enumerate(handlers):
+            if handler._opaque:
+                self.tail = handler
+                handlers = handlers[:position]
+                break
+        self.handlers = handlers
+        self.size = len(handlers)
+        # Ключ -> позиция первого обработчика, объявившего этот ключ.
+        self.index: Dict[Any, int] = {}
+        # (позиция, обработчик) для обработчиков без ключей.
+        self.fallback: List[Tuple[int, Handler]] = []
+        for position, handler in enumerate(handlers):
+            if handler.keys:
+                for key in handler.keys:
+                    self.index.setdefault(key, position)
+            else:
+                self.fallback.append((position, handler))
+
 
 class ConcreteHandlerA(Handler):
     """
     Конкретный обработчик А.
     """
 
-    def handle(self, request: Any) -> Optional[str]:
+    keys = ("A",)
+
+    def process(self, request: Any) -> Optional[str]:
         if request == "A":
             return "Handler A обработал запрос А."
-        else:
-            print("Handler A передает запрос дальше")
-            return self._handle_next(request)
+        return None
 
 
 class ConcreteHandlerB(Handler):
@@ -67,12 +281,12 @@ class ConcreteHandlerB(Handler):
     Конкретный обработчик B.
     """
 
-    def handle(self, request: Any) -> Optional[str]:
+    keys = ("B",)
+
+    def process(self, request: Any) -> Optional[str]:
         if request == "B":
             return "Handler B обработал запрос B."
-        else:
-            print("Handler B передает запрос дальше")
-            return self._handle_next(request)
+        return None
 
 
 class ConctreteHandlerC(Handler):
@@ -80,12 +294,205 @@ class ConctreteHandlerC(Handler):
     Конкретный обработчик C.
     """
 
-    def handle(self, request: Any) -> Optional[str]:
+    keys = ("C",)
+
+    def process(self, request: Any) -> Optional[str]:
         if request == "C":
             return "Handler C обработал запрос C."
+        return None
+
+
+class HandlerStats:
+    """Счетчики одного звена цепочки."""
+
+    __slots__ = ("hits", "misses", "sampled", "total_time")
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.sampled = 0
+        self.total_time = 0.0
+
+    @property
+    def mean_time(self) -> float:
+        """Среднее время звена по выборке, в секундах."""
+        return self.total_time / self.sampled if self.sampled else 0.0
+
+
+class ChainTracer:
+    """
+    Трассировщик цепочки обработчиков.
+
+    Считает попадания и промахи каждого звена, а время измеряет
+    только у доли ``sample_rate`` переходов. Для своих метрик
+    или логирования переопределите ``on_hop``.
+    """
+
+    def __init__(self, sample_rate: float = 0.01):
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate должен быть в диапазоне [0, 1]")
+        self.sample_rate = sample_rate
+        self.stats: Dict[Handler, HandlerStats] = {}
+
+    def _sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def _stats_for(self, handler: Handler) -> HandlerStats:
+        stats = self.stats.get(handler)
+        if stats is None:
+            stats = self.stats[handler] = HandlerStats()
+        return stats
+
+    def trace(self, handler: Handler, request: Any) -> Optional[str]:
+        stats = self._stats_for(handler)
+        if self._sampled():
+            start = time.perf_counter()
+            result = handler.process(request)
+            elapsed = time.perf_counter() - start
+            stats.sampled += 1
+            stats.total_time += elapsed
+            self.on_hop(handler, 1, elapsed)
         else:
-            print("Handler C передает запрос дальше")
-            return self._handle_next(request)
+            result = handler.process(request)
+        if result is None:
+            stats.misses += 1
+        else:
+            stats.hits += 1
+        return result
+
+    def trace_batch(self, handler: Handler,
+                    requests: List[Any]) -> List[Optional[str]]:
+        stats = self._stats_for(handler)
+        if self._sampled():
+            start = time.perf_counter()
+            results = handler.process_batch(requests)
+            elapsed = time.perf_counter() - start
+            stats.sampled += len(requests)
+            stats.total_time += elapsed
+            self.on_hop(handler, len(requests), elapsed)
+        else:
+            results = handler.process_batch(requests)
+        misses = results.count(None)
+        stats.misses += misses
+        stats.hits += len(results) - misses
+        return results
+
+    def on_hop(self, handler: Handler, count: int, elapsed: float) -> None:
+        """Вызывается для каждого измеренного перехода (count запросов)."""
+        pass
+
+    def report(self) -> List[Tuple[str, HandlerStats]]:
+        """Звенья цепочки от самого нагруженного к наименее нагруженному."""
+        return sorted(
+            ((type(handler).__name__, stats)
+             for handler, stats in self.stats.items()),
+            key=lambda item: item[1].hits + item[1].misses,
+            reverse=True,
+        )
+
+
+class AsyncHandler(ABC):
+    """
+    Асинхронный обработчик.
+
+    Порядок цепочки тот же: побеждает первый ответивший обработчик.
+    Если задан ``timeout`` и звено не успело ответить, запрос
+    передается следующему обработчику.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self._next_handler: Optional[AsyncHandler] = None
+        self.timeout = timeout
+
+    def set_next(self, handler: "AsyncHandler") -> "AsyncHandler":
+        self._next_handler = handler
+        return handler
+
+    async def handle(self, request: Any) -> Optional[str]:
+        try:
+            result = await asyncio.wait_for(self.process(request),
+                                            self.timeout)
+        except asyncio.TimeoutError:
+            result = None
+        if result is None:
+            return await self._handle_next(request)
+        return result
+
+    @abstractmethod
+    async def process(self, request: Any) -> Optional[str]:
+        """Обработать запрос только этим звеном, без передачи дальше."""
+        pass
+
+    async def _handle_next(self, request: Any) -> Optional[str]:
+        if self._next_handler:
+            return await self._next_handler.handle(request)
+        return None
+
+
+async def handle_concurrently(handler: AsyncHandler, requests: Iterable[Any],
+                              concurrency: int = 10) -> List[Optional[str]]:
+    """
+    Прогоняет запросы через асинхронную цепочку параллельно.
+
+    Одновременно обрабатывается не больше ``concurrency`` запросов.
+    Очередь ограничена тем же размером, поэтому новые запросы не
+    читаются из ``requests``, пока воркеры не освободятся.
+    Результаты возвращаются в порядке запросов.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency должно быть не меньше 1")
+
+    results: Dict[int, Optional[str]] = {}
+    errors: List[BaseException] = []
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+
+    async def worker() -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, request = item
+            if errors:
+                # После первой ошибки только вычитываем очередь,
+                # чтобы не заблокировать отправку запросов.
+                continue
+            try:
+                results[index] = await handler.handle(request)
+            except Exception as error:
+                errors.append(error)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        count = 0
+        for count, request in enumerate(requests, 1):
+            await queue.put((count - 1, request))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    if errors:
+        raise errors[0]
+    return [results[i] for i in range(count)]
+
+
+class AsyncBackendHandler(AsyncHandler):
+    """
+    Асинхронный обработчик, обращающийся к медленному бэкенду.
+    """
+
+    def __init__(self, key: str, delay: float,
+                 timeout: Optional[float] = None):
+        super().__init__(timeout)
+        self.key = key
+        self.delay = delay
+
+    async def process(self, request: Any) -> Optional[str]:
+        if request != self.key:
+            return None
+        await asyncio.sleep(self.delay)
+        return f"Async handler {self.key} обработал запрос {request}."
 
 
 def client_code(handler: Handler, requests: list) -> None:
@@ -107,4 +514,28 @@ if __name__ == "__main__":
 
     requests = ["A", "B", "C", "A", "D"]
 
+    tracer = ChainTracer(sample_rate=0.5)
+    handler_a.set_tracer(tracer)
     client_code(handler_a, requests)
+    for name, stats in tracer.report():
+        print(f"{name}: попаданий {stats.hits}, промахов {stats.misses}, "
+              f"среднее время {stats.mean_time * 1e6:.1f} мкс")
+    handler_a.set_tracer(None)
+
+    print("\nДиспетчеризация через скомпилированный индекс:")
+    for request in requests:
+        print(handler_a.dispatch(request) or "Запрос не был обработан")
+
+    print("\nПакетная обработка:")
+    for result in handler_a.handle_stream(requests * 2, batch_size=4):
+        print(result or "Запрос не был обработан")
+
+    print("\nАсинхронная цепочка:")
+    async_a = AsyncBackendHandler("A", delay=0.01)
+    # Бэкенд B не укладывается в таймаут, запрос уходит дальше.
+    async_b = AsyncBackendHandler("B", delay=1, timeout=0.05)
+    async_c = AsyncBackendHandler("C", delay=0.01)
+    async_a.set_next(async_b).set_next(async_c)
+    for result in asyncio.run(
+            handle_concurrently(async_a, requests, concurrency=2)):
+        print(result or "Запрос не был обработан")
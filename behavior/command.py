@@ -24,8 +24,24 @@
 
 
 from abc import ABC, abstractmethod
-from typing import List
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+from threading import Lock
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
 from datetime import datetime
+import contextlib
+import gc
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
 
 
 class Command(ABC):
@@ -41,6 +57,57 @@ class Command(ABC):
         """Отменить команду."""
         pass
 
+    def receiver(self) -> Optional[Any]:
+        """Получатель команды, None - команда затрагивает разных получателей."""
+        return None
+
+    def overrides(self, other: "Command") -> bool:
+        """True, если после выполнения self выполнять other не нужно."""
+        return False
+
+    def undo_state(self) -> Any:
+        """Данные для отмены, снимаются сразу после execute."""
+        return None
+
+    def undo_with(self, state: Any) -> None:
+        """Отменить выполнение, описанное state из undo_state."""
+        self.undo()
+
+    def replay(self) -> None:
+        """Повторить команду при восстановлении из журнала, без вывода."""
+        self.execute()
+
+    def replay_undo(self, state: Any) -> None:
+        """Повторить отмену при восстановлении из журнала, без вывода."""
+        self.undo_with(state)
+
+    def children(self) -> List["Command"]:
+        """Вложенные команды."""
+        return []
+
+    def save_state(self) -> Any:
+        """Состояние для контрольной точки: примитивы, кортежи и UndoRecord."""
+        return None
+
+    def load_state(self, state: Any) -> None:
+        """Восстанавливает состояние из save_state."""
+        pass
+
+
+class UndoRecord(NamedTuple):
+    """
+    Запись для отмены, не зависящая от объекта команды.
+
+    Одна и та же команда может быть нажата несколько раз, и у каждого
+    нажатия своя запись со своим предыдущим состоянием.
+    """
+
+    command: Command
+    state: Any
+
+    def undo(self) -> None:
+        self.command.undo_with(self.state)
+
 
 class Light:
     """Светильник."""
@@ -57,6 +124,12 @@ class Light:
         self.is_on = False
         print(f"Свет в {self.location} выключен")
 
+    def save_state(self) -> bool:
+        return self.is_on
+
+    def load_state(self, state: bool) -> None:
+        self.is_on = state
+
 
 class Thermostat:
     """Термостат."""
@@ -69,6 +142,12 @@ class Thermostat:
         self.temperature = temp
         print(f"Температура в {self.location} установлена на {temp}°C")
 
+    def save_state(self) -> float:
+        return self.temperature
+
+    def load_state(self, state: float) -> None:
+        self.temperature = state
+
 
 class LightOnCommand(Command):
     """Команда включения света."""
@@ -80,13 +159,40 @@ class LightOnCommand(Command):
     def execute(self) -> None:
         self.previous_state = self.light.is_on
         self.light.turn_on()
+
+    def replay(self) -> None:
+        self.previous_state = self.light.is_on
+        self.light.is_on = True
+
+    def replay_undo(self, state: Optional[bool]) -> None:
+        if state is not None:
+            self.light.is_on = state
     
     def undo(self) -> None:
-        if self.previous_state is False:
+        self.undo_with(self.previous_state)
+
+    def undo_state(self) -> Optional[bool]:
+        return self.previous_state
+
+    def undo_with(self, state: Optional[bool]) -> None:
+        if state is False:
             self.light.turn_off()
-        elif self.previous_state is True:
+        elif state is True:
             self.light.turn_on()
 
+    def receiver(self) -> Light:
+        return self.light
+
+    def save_state(self) -> Optional[bool]:
+        return self.previous_state
+
+    def load_state(self, state: Optional[bool]) -> None:
+        self.previous_state = state
+
+    def overrides(self, other: Command) -> bool:
+        return (isinstance(other, (LightOnCommand, LightOffCommand))
+                and other.light is self.light)
+
 
 class LightOffCommand(Command):
     """Команда выключения света."""
@@ -98,31 +204,162 @@ class LightOffCommand(Command):
     def execute(self) -> None:
         self.previous_state = self.light.is_on
         self.light.turn_off()
+
+    def replay(self) -> None:
+        self.previous_state = self.light.is_on
+        self.light.is_on = False
+
+    def replay_undo(self, state: Optional[bool]) -> None:
+        if state is not None:
+            self.light.is_on = state
     
     def undo(self) -> None:
-        if self.previous_state is True:
+        self.undo_with(self.previous_state)
+
+    def undo_state(self) -> Optional[bool]:
+        return self.previous_state
+
+    def undo_with(self, state: Optional[bool]) -> None:
+        if state is True:
             self.light.turn_on()
-        elif self.previous_state is False:
+        elif state is False:
             self.light.turn_off()
 
+    def receiver(self) -> Light:
+        return self.light
+
+    def save_state(self) -> Optional[bool]:
+        return self.previous_state
+
+    def load_state(self, state: Optional[bool]) -> None:
+        self.previous_state = state
+
+    def overrides(self, other: Command) -> bool:
+        return (isinstance(other, (LightOnCommand, LightOffCommand))
+                and other.light is self.light)
+
 
 class MacroCommand(Command):
-    """Макрокоманда - набор нескольких команд."""
+    """
+    Макрокоманда - набор нескольких команд.
 
-    def __init__(self, commands: List[Command]):
+    В параллельном режиме команды группируются по получателю, группы
+    выполняются одновременно, а порядок внутри группы сохраняется.
+    executed_commands хранит порядок завершения, при ошибке
+    откатываются только успевшие выполниться команды. Пул потоков
+    создается при первом параллельном выполнении и освобождается close().
+    """
+
+    def __init__(self, commands: List[Command], parallel: bool = False,
+                 max_workers: Optional[int] = None):
         self.commands = commands
         self.executed_commands = []
+        self.parallel = parallel
+        self.max_workers = max_workers
+        self._undo_records: List[UndoRecord] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
     
     def execute(self) -> None:
         self.executed_commands = []
+        self._undo_records = []
+        if not self.parallel:
+            for command in self.commands:
+                command.execute()
+                self._completed(command, command.undo_state())
+            return
+
+        for segment in self._segments():
+            if isinstance(segment, Command):
+                try:
+                    segment.execute()
+                except Exception:
+                    self._rollback()
+                    raise
+                self._completed(segment, segment.undo_state())
+                continue
+            completed, error = _run_lanes(segment, self._lanes_executor())
+            for lane_index, position, state in completed:
+                self._completed(segment[lane_index][position], state)
+            if error is not None:
+                self._rollback()
+                raise error
+
+    def _lanes_executor(self) -> Optional[ThreadPoolExecutor]:
+        if self.max_workers == 1:
+            return None
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def close(self) -> None:
+        """Останавливает пул потоков параллельного режима."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _completed(self, command: Command, state: Any) -> None:
+        self.executed_commands.append(command)
+        self._undo_records.append(UndoRecord(command, state))
+
+    def _rollback(self) -> None:
+        self.undo_with(self._undo_records)
+        self.executed_commands = []
+        self._undo_records = []
+
+    def _segments(self) -> List[Any]:
+        """
+        Делит команды на группы по получателю.
+
+        Команда без получателя (например, вложенная макрокоманда)
+        выполняется отдельно, после всех команд перед ней.
+        """
+        segments: List[Any] = []
+        lanes: Dict[int, List[Command]] = {}
         for command in self.commands:
-            command.execute()
-            self.executed_commands.append(command)
+            receiver = command.receiver()
+            if receiver is None:
+                if lanes:
+                    segments.append(list(lanes.values()))
+                    lanes = {}
+                segments.append(command)
+            else:
+                lanes.setdefault(id(receiver), []).append(command)
+        if lanes:
+            segments.append(list(lanes.values()))
+        return segments
     
     def undo(self) -> None:
         for command in reversed(self.executed_commands):
             command.undo()
 
+    def undo_state(self) -> Tuple[UndoRecord, ...]:
+        return tuple(self._undo_records)
+
+    def undo_with(self, state: Tuple[UndoRecord, ...]) -> None:
+        for record in reversed(state):
+            record.undo()
+
+    def replay(self) -> None:
+        self.executed_commands = []
+        self._undo_records = []
+        for command in self.commands:
+            command.replay()
+            self._completed(command, command.undo_state())
+
+    def replay_undo(self, state: Tuple[UndoRecord, ...]) -> None:
+        for record in reversed(state):
+            record.command.replay_undo(record.state)
+
+    def children(self) -> List[Command]:
+        return self.commands
+
+    def save_state(self) -> Tuple[UndoRecord, ...]:
+        return self.undo_state()
+
+    def load_state(self, state: Tuple[UndoRecord, ...]) -> None:
+        self._undo_records = list(state)
+        self.executed_commands = [record.command for record in state]
+
 
 class SetTemperatureCommand(Command):
     """Команда установки температуры."""
@@ -135,20 +372,461 @@ class SetTemperatureCommand(Command):
     def execute(self) -> None:
         self.previous_temperature = self.thermostat.temperature
         self.thermostat.set_temperature(self.temperature)
+
+    def replay(self) -> None:
+        self.previous_temperature = self.thermostat.temperature
+        self.thermostat.temperature = self.temperature
+
+    def replay_undo(self, state: Optional[float]) -> None:
+        if state is not None:
+            self.thermostat.temperature = state
     
     def undo(self) -> None:
-        if self.previous_temperature is not None:
-            self.thermostat.set_temperature(self.previous_temperature)
+        self.undo_with(self.previous_temperature)
+
+    def undo_state(self) -> Optional[float]:
+        return self.previous_temperature
+
+    def undo_with(self, state: Optional[float]) -> None:
+        if state is not None:
+            self.thermostat.set_temperature(state)
+
+    def receiver(self) -> Thermostat:
+        return self.thermostat
+
+    def save_state(self) -> Optional[float]:
+        return self.previous_temperature
+
+    def load_state(self, state: Optional[float]) -> None:
+        self.previous_temperature = state
+
+    def overrides(self, other: Command) -> bool:
+        return (isinstance(other, SetTemperatureCommand)
+                and other.thermostat is self.thermostat)
+
+
+def _run_lanes(lanes: List[List[Command]],
+               executor: Optional[ThreadPoolExecutor]
+               ) -> Tuple[List[Tuple[int, int, Any]], Optional[BaseException]]:
+    """
+    Выполняет очереди команд параллельно, каждую - строго по порядку.
+
+    Очереди запускаются в переданном пуле потоков, без пула -
+    последовательно.
+
+    Возвращает выполненные команды как тройки (очередь, позиция,
+    undo_state) в порядке завершения и первую ошибку. Очередь с ошибкой
+    останавливается, остальные доводятся до конца.
+    """
+    completed: List[Tuple[int, int, Any]] = []
+    errors: List[BaseException] = []
+    lock = Lock()
+
+    def run(lane_index: int) -> None:
+        for position, command in enumerate(lanes[lane_index]):
+            try:
+                command.execute()
+            except Exception as error:
+                with lock:
+                    errors.append(error)
+                return
+            state = command.undo_state()
+            with lock:
+                completed.append((lane_index, position, state))
+
+    if len(lanes) == 1 or executor is None:
+        for lane_index in range(len(lanes)):
+            run(lane_index)
+    else:
+        list(executor.map(run, range(len(lanes))))
+    return completed, errors[0] if errors else None
+
+
+class _Coalesced(Command):
+    """
+    Перекрытая в очереди команда. Выполняется через replay - без
+    вывода и обращения к устройству, только чтобы снять undo_state
+    и сохранить отмену такой же, как без очереди.
+    """
+
+    def __init__(self, command: Command):
+        self.command = command
+
+    def execute(self) -> None:
+        self.command.replay()
+
+    def undo(self) -> None:
+        self.command.undo()
+
+    def undo_state(self) -> Any:
+        return self.command.undo_state()
+
+
+class CommandQueue:
+    """
+    Очередь команд, объединяющая избыточные команды одного получателя.
+
+    Если новая команда перекрывает последнюю ожидающую команду того же
+    получателя (например, выключение после включения того же света),
+    старая команда помечается перекрытой: при выполнении она только
+    повторяется без вывода (replay) ради записи отмены. Команды без
+    получателя служат барьером: все, что было до них, выполняется раньше.
+    """
+
+    def __init__(self):
+        # Сегменты: словарь очередей по получателю либо команда-барьер.
+        # Элемент очереди - (номер нажатия, команда, перекрыта ли).
+        self._segments: deque = deque()
+        self._sequence = 0
+
+    def __len__(self) -> int:
+        """Число команд, которые будут выполнены с выводом."""
+        return sum(
+            1 if isinstance(segment, Command)
+            else sum(not skipped for lane in segment.values()
+                     for _, _, skipped in lane)
+            for segment in self._segments
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self._segments)
+
+    def add(self, command: Command) -> None:
+        receiver = command.receiver()
+        if receiver is None:
+            self._segments.append(command)
+            return
+        if not self._segments or isinstance(self._segments[-1], Command):
+            self._segments.append({})
+        lane = self._segments[-1].setdefault(id(receiver), [])
+        for i in range(len(lane) - 1, -1, -1):
+            sequence, queued, skipped = lane[i]
+            if skipped:
+                continue
+            if not command.overrides(queued):
+                break
+            lane[i] = (sequence, queued, True)
+        lane.append((self._sequence, command, False))
+        self._sequence += 1
+
+    def pop(self) -> Any:
+        """Забирает первый сегмент."""
+        return self._segments.popleft()
+
+    def push_front(self, segment: Any) -> None:
+        """Возвращает невыполненный остаток сегмента в начало очереди."""
+        self._segments.appendleft(segment)
+
+
+class Action(IntEnum):
+    """Нажатая кнопка."""
+
+    ON = 0
+    OFF = 1
+
+
+class HistoryEntry(NamedTuple):
+    timestamp: float
+    action: Action
+    slot: int
+    command_type: str
+
+
+class CommandHistory:
+    """
+    История нажатий в кольцевом буфере фиксированной емкости.
+
+    Записи хранятся в параллельных массивах: время (float), кнопка,
+    номер слота и идентификатор типа команды. При переполнении
+    затираются самые старые записи.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        if capacity < 1:
+            raise ValueError("Емкость истории должна быть положительной")
+        self.capacity = capacity
+        self._timestamps = self._column("d")
+        self._actions = self._column("B")
+        self._slots = self._column("i")
+        self._types = self._column("H")
+        self._type_ids: Dict[type, int] = {}
+        self._type_names: List[str] = []
+        self._start = 0
+        self._size = 0
+
+    def _column(self, typecode: str) -> array:
+        return array(typecode, bytes(array(typecode).itemsize * self.capacity))
+
+    def _type_id(self, command: Command) -> int:
+        command_type = type(command)
+        type_id = self._type_ids.get(command_type)
+        if type_id is None:
+            type_id = self._type_ids[command_type] = len(self._type_names)
+            self._type_names.append(command_type.__name__)
+        return type_id
+
+    def append(self, action: Action, slot: int, command: Command,
+               timestamp: Optional[float] = None) -> None:
+        """Добавляет запись, вытесняя самую старую при переполнении."""
+        if self._size < self.capacity:
+            position = (self._start + self._size) % self.capacity
+            self._size += 1
+        else:
+            position = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._timestamps[position] = (time.time() if timestamp is None
+                                      else timestamp)
+        self._actions[position] = action
+        self._slots[position] = slot
+        self._types[position] = self._type_id(command)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[HistoryEntry]:
+        """Лениво обходит записи от старых к новым."""
+        for offset in range(self._size):
+            position = (self._start + offset) % self.capacity
+            yield HistoryEntry(
+                self._timestamps[position],
+                Action(self._actions[position]),
+                self._slots[position],
+                self._type_names[self._types[position]],
+            )
+
+
+class JournalOp(IntEnum):
+    """Операция в журнале команд."""
+
+    ON = Action.ON
+    OFF = Action.OFF
+    UNDO = 2
+
+
+class CommandJournal:
+    """
+    Журнал упреждающей записи (WAL) нажатий пульта.
+
+    Записи фиксированного размера дописываются в файл, отображенный
+    в память (mmap). Счетчик записей в заголовке обновляется группами
+    (group commit): после ``group_size`` записей или ``group_interval``
+    секунд с прошлой фиксации. Политика fsync:
+        "always" - сбрасывать на диск каждую запись;
+        "group"  - сбрасывать на диск при каждой групповой фиксации;
+        "never"  - только обновлять заголовок, сброс оставить ОС.
+    Незафиксированный хвост при сбое теряется. Группа, открытая
+    в момент простоя, фиксируется следующим нажатием, commit() или close().
+
+    Каждые ``checkpoint_every`` записей пульт сохраняет контрольную
+    точку рядом с журналом, и восстановление читает только хвост после нее.
+    """
+
+    MAGIC = b"RCJ1"
+    HEADER = struct.Struct("<4s4xQ")
+    RECORD = struct.Struct("<dB3xi")
+    FSYNC_POLICIES = ("always", "group", "never")
+
+    def __init__(self, path: str, fsync: str = "group", group_size: int = 64,
+                 group_interval: float = 0.005, checkpoint_every: int = 10000,
+                 initial_records: int = 4096):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"Неизвестная политика fsync: {fsync}")
+        self.path = path
+        self.checkpoint_path = path + ".ckpt"
+        self.fsync = fsync
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.checkpoint_every = checkpoint_every
+
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self._file.truncate(self._offset(initial_records))
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        if exists:
+            magic, committed = self.HEADER.unpack_from(self._map, 0)
+            if magic != self.MAGIC:
+                raise ValueError(f"{path} не является журналом команд")
+        else:
+            committed = 0
+            self.HEADER.pack_into(self._map, 0, self.MAGIC, committed)
+        # Все, что записано после зафиксированного счетчика, отбрасывается.
+        self._count = self._committed = committed
+        self._last_commit = time.monotonic()
+        self._last_checkpoint = self._checkpoint_records()
+
+    def _offset(self, record: int) -> int:
+        return self.HEADER.size + record * self.RECORD.size
+
+    def __len__(self) -> int:
+        return self._committed
+
+    def append(self, op: JournalOp, slot: int) -> None:
+        """Дописывает запись и при необходимости фиксирует группу."""
+        offset = self._offset(self._count)
+        if offset + self.RECORD.size > len(self._map):
+            self._grow()
+        self.RECORD.pack_into(self._map, offset, time.time(), op, slot)
+        self._count += 1
+        if (self.fsync == "always"
+                or self._count - self._committed >= self.group_size
+                or time.monotonic() - self._last_commit
+                >= self.group_interval):
+            self.commit()
+
+    def _grow(self) -> None:
+        size = len(self._map) * 2
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def commit(self) -> None:
+        """Фиксирует записанные записи, обновляя счетчик в заголовке."""
+        if self._count == self._committed:
+            return
+        if self.fsync != "never":
+            # Сначала записи, потом заголовок, который на них ссылается.
+            start = self._offset(self._committed)
+            start -= start % mmap.PAGESIZE
+            self._map.flush(start, self._offset(self._count) - start)
+        self.HEADER.pack_into(self._map, 0, self.MAGIC, self._count)
+        if self.fsync != "never":
+            self._map.flush(0, mmap.PAGESIZE)
+        self._committed = self._count
+        self._last_commit = time.monotonic()
+
+    def records(self, start: int = 0) -> Iterator[Tuple[float, int, int]]:
+        """Зафиксированные записи (время, операция, слот) начиная с start."""
+        view = memoryview(self._map)[self._offset(start):
+                                     self._offset(self._committed)]
+        try:
+            yield from self.RECORD.iter_unpack(view)
+        finally:
+            view.release()
+
+    def checkpoint_due(self) -> bool:
+        return self._count - self._last_checkpoint >= self.checkpoint_every
+
+    def write_checkpoint(self, state: dict) -> None:
+        """Атомарно сохраняет состояние пульта на текущей позиции журнала."""
+        self.commit()
+        temporary = self.checkpoint_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump({"records": self._committed, "state": state}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.checkpoint_path)
+        self._last_checkpoint = self._committed
+
+    def load_checkpoint(self) -> Optional[dict]:
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def _checkpoint_records(self) -> int:
+        checkpoint = self.load_checkpoint()
+        return checkpoint["records"] if checkpoint else 0
+
+    def close(self) -> None:
+        self.commit()
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+
+def _remote_objects(remote: "RemoteControl") -> List[Any]:
+    """Команды и устройства пульта в детерминированном порядке обхода."""
+    objects: List[Any] = []
+    seen = set()
+
+    def visit(command: Command) -> None:
+        if id(command) in seen:
+            return
+        seen.add(id(command))
+        objects.append(command)
+        device = command.receiver()
+        if device is not None and id(device) not in seen:
+            seen.add(id(device))
+            objects.append(device)
+        for child in command.children():
+            visit(child)
+
+    for slot in sorted(remote.on_commands):
+        visit(remote.on_commands[slot])
+        visit(remote.off_commands[slot])
+    return objects
+
+
+def _encode(value: Any, index: Dict[int, int]) -> Any:
+    """Переводит состояние в JSON: команды заменяются их номерами."""
+    if isinstance(value, UndoRecord):
+        return {"command": index[id(value.command)],
+                "state": _encode(value.state, index)}
+    if isinstance(value, tuple):
+        return [_encode(item, index) for item in value]
+    return value
+
+
+def _decode(value: Any, objects: List[Any]) -> Any:
+    if isinstance(value, dict):
+        return UndoRecord(objects[value["command"]],
+                          _decode(value["state"], objects))
+    if isinstance(value, list):
+        return tuple(_decode(item, objects) for item in value)
+    return value
+
+
+def _capture_state(remote: "RemoteControl") -> dict:
+    """Снимок состояния команд и устройств и стека отмены."""
+    objects = _remote_objects(remote)
+    index = {id(obj): i for i, obj in enumerate(objects)}
+    return {
+        "objects": [_encode(obj.save_state(), index) for obj in objects],
+        "undo_stack": [_encode(record, index) for record in remote.undo_stack],
+    }
+
+
+def _restore_state(remote: "RemoteControl", state: dict) -> None:
+    objects = _remote_objects(remote)
+    if len(objects) != len(state["objects"]):
+        raise ValueError("Конфигурация пульта не совпадает с контрольной точкой")
+    for obj, saved in zip(objects, state["objects"]):
+        obj.load_state(_decode(saved, objects))
+    remote.undo_stack.clear()
+    remote.undo_stack.extend(_decode(record, objects)
+                             for record in state["undo_stack"])
 
 
 class RemoteControl:
     """Пульт управления умным домом."""
 
-    def __init__(self):
+    def __init__(self, history_capacity: int = 10000, queued: bool = False,
+                 max_workers: int = 4,
+                 journal: Optional[CommandJournal] = None,
+                 undo_limit: Optional[int] = None, compact_undo: bool = False):
         self.on_commands = {}
         self.off_commands = {}
-        self.history = []
-        self.undo_stack = []
+        self.history = CommandHistory(history_capacity)
+        # Стек отмены хранит UndoRecord, а не сами команды. При заданном
+        # undo_limit самые старые записи вытесняются. При compact_undo
+        # подряд идущие перекрывающие друг друга команды одного получателя
+        # сворачиваются в одну запись: отмена возвращает состояние
+        # получателя на момент до всей серии.
+        self.undo_stack: deque = deque(maxlen=undo_limit)
+        self.compact_undo = compact_undo
+        # В режиме очереди команды копятся до flush(), избыточные
+        # объединяются, а разные получатели обрабатываются параллельно.
+        # Перекрытые команды выполняются без вывода через replay и
+        # попадают в стек отмены, так что отмена работает как без очереди.
+        # Пул потоков для flush() создается при первой необходимости
+        # и освобождается close().
+        self.queue: Optional[CommandQueue] = CommandQueue() if queued else None
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if journal is not None and queued:
+            raise ValueError("Журнал не поддерживается в режиме очереди")
+        self.journal = journal
     
     def set_command(self, slot: int, on_command: Command,
                     off_command: Command) -> None:
@@ -160,31 +838,221 @@ class RemoteControl:
         """Нажать кнопку включения."""
         if slot in self.on_commands:
             command = self.on_commands[slot]
-            command.execute()
-            self.history.append((datetime.now(), "ON", slot, command))
-            self.undo_stack.append(command)
+            self._submit(command, Action.ON, slot)
+            self.history.append(Action.ON, slot, command)
     
     def press_off_button(self, slot: int) -> None:
         """Нажать кнопку выключения."""
         if slot in self.off_commands:
             command = self.off_commands[slot]
+            self._submit(command, Action.OFF, slot)
+            self.history.append(Action.OFF, slot, command)
+
+    def _submit(self, command: Command, action: Action, slot: int) -> None:
+        if self.queue is None:
             command.execute()
-            self.history.append((datetime.now(), "OFF", slot, command))
-            self.undo_stack.append(command)
+            self._push_undo(command, command.undo_state())
+            self._journal(JournalOp(action), slot)
+        else:
+            self.queue.add(command)
+
+    def _push_undo(self, command: Command, state: Any) -> None:
+        if (self.compact_undo and self.undo_stack
+                and command.overrides(self.undo_stack[-1].command)):
+            return
+        self.undo_stack.append(UndoRecord(command, state))
+
+    def _journal(self, op: JournalOp, slot: int) -> None:
+        if self.journal is None:
+            return
+        self.journal.append(op, slot)
+        if self.journal.checkpoint_due():
+            self.journal.write_checkpoint(_capture_state(self))
+
+    def recover(self) -> int:
+        """
+        Восстанавливает состояние устройств и стек отмены из журнала.
+
+        Пульт должен быть настроен теми же командами, что и при записи.
+        Состояние берется из последней контрольной точки, после нее
+        без вывода повторяются только записи хвоста. История заполняется
+        последними нажатиями из журнала. Возвращает число повторенных записей.
+        """
+        if self.journal is None:
+            raise ValueError("У пульта нет журнала")
+        start = 0
+        checkpoint = self.journal.load_checkpoint()
+        if checkpoint is not None:
+            _restore_state(self, checkpoint["state"])
+            start = checkpoint["records"]
+
+        replayed = 0
+        for _, op, slot in self.journal.records(start):
+            replayed += 1
+            if op == JournalOp.UNDO:
+                if self.undo_stack:
+                    command, state = self.undo_stack.pop()
+                    command.replay_undo(state)
+                continue
+            commands = self.on_commands if op == JournalOp.ON else self.off_commands
+            command = commands[slot]
+            command.replay()
+            self._push_undo(command, command.undo_state())
+
+        tail = max(0, len(self.journal) - self.history.capacity)
+        for timestamp, op, slot in self.journal.records(tail):
+            if op != JournalOp.UNDO:
+                commands = self.on_commands if op == JournalOp.ON else self.off_commands
+                self.history.append(Action(op), slot, commands[slot], timestamp)
+        return replayed
+
+    def flush(self) -> None:
+        """Выполняет накопленные в очереди команды."""
+        if self.queue is None:
+            return
+        # Сегменты снимаются по одному: при ошибке все, что не успело
+        # выполниться, остается в очереди.
+        while self.queue:
+            segment = self.queue.pop()
+            if isinstance(segment, Command):
+                segment.execute()
+                self._push_undo(segment, segment.undo_state())
+                continue
+            entries = list(segment.values())
+            lanes = [[_Coalesced(command) if skipped else command
+                      for _, command, skipped in lane] for lane in entries]
+            completed, error = _run_lanes(lanes, self._lanes_executor())
+            # В стек отмены - в порядке нажатий, как без очереди.
+            for lane_index, position, state in sorted(
+                    completed, key=lambda item: entries[item[0]][item[1]][0]):
+                self._push_undo(entries[lane_index][position][1], state)
+            if error is not None:
+                done = [0] * len(entries)
+                for lane_index, _, _ in completed:
+                    done[lane_index] += 1
+                # Упавшая команда не повторяется, остаток ее очереди ждет.
+                rest = {key: lane[done[i] + 1:]
+                        for i, (key, lane) in enumerate(segment.items())
+                        if done[i] + 1 < len(lane)}
+                if rest:
+                    self.queue.push_front(rest)
+                raise error
     
+    def _lanes_executor(self) -> Optional[ThreadPoolExecutor]:
+        if self.max_workers <= 1:
+            return None
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def close(self) -> None:
+        """Выполняет остаток очереди и останавливает пул потоков."""
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
     def press_undo(self) -> None:
         """Отменить последнюю операцию."""
+        self.flush()
         if self.undo_stack:
-            command = self.undo_stack.pop()
-            command.undo()
+            record = self.undo_stack.pop()
+            record.undo()
+            self._journal(JournalOp.UNDO, 0)
             print("Отмена последней операции")
     
     def show_history(self) -> None:
         """Показать историю комманд."""
         print("История комманд")
-        for time, action, slot, command in self.history:
-            print(f"{time.strftime('%H:%M:%S')} - "
-                  f"{action} слот {slot} ({command.__class__.__name__})")
+        for timestamp, action, slot, command_type in self.history:
+            print(f"{time.strftime('%H:%M:%S', time.localtime(timestamp))} - "
+                  f"{action.name} слот {slot} ({command_type})")
+
+
+def check_queued_undo() -> None:
+    """Проверяет, что отмена в режиме очереди дает то же, что без нее."""
+    results = []
+    for queued in (False, True):
+        light = Light("проверки")
+        thermostat = Thermostat("проверки")
+        remote = RemoteControl(queued=queued)
+        remote.set_command(0, LightOnCommand(light), LightOffCommand(light))
+        remote.set_command(1, SetTemperatureCommand(thermostat, 24),
+                           SetTemperatureCommand(thermostat, 18))
+        states = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for press in (remote.press_on_button, remote.press_off_button):
+                press(0)
+                press(1)
+            remote.press_on_button(0)
+            for _ in range(6):
+                remote.press_undo()
+                states.append((light.is_on, thermostat.temperature))
+            remote.close()
+        results.append(states)
+    assert results[0] == results[1], results
+    print("Отмена с очередью и без нее дает одинаковые состояния")
+
+
+def benchmark_history_memory(entries: int = 100000) -> None:
+    """Сравнивает память на запись: список кортежей и CommandHistory."""
+    command = LightOnCommand(Light("кладовой"))
+
+    tracemalloc.start()
+    legacy = []
+    for i in range(entries):
+        legacy.append((datetime.now(), "ON", i % 8, command))
+    legacy_bytes = tracemalloc.get_traced_memory()[0]
+    del legacy
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    history = CommandHistory(entries)
+    for i in range(entries):
+        history.append(Action.ON, i % 8, command)
+    history_bytes = tracemalloc.get_traced_memory()[0]
+    del history
+    tracemalloc.stop()
+
+    print(f"Список кортежей: {legacy_bytes / entries:.1f} байт на запись")
+    print(f"CommandHistory: {history_bytes / entries:.1f} байт на запись")
+
+
+def benchmark_undo_memory(presses: int = 80000,
+                          undo_limit: int = 1000) -> None:
+    """Показывает, что память стека отмены не растет с числом нажатий."""
+    remote = RemoteControl(history_capacity=1000, undo_limit=undo_limit,
+                           compact_undo=True)
+    for slot in range(4):
+        light = Light(f"комнате {slot}")
+        remote.set_command(slot, LightOnCommand(light), LightOffCommand(light))
+    thermostat = Thermostat("подвале")
+    remote.set_command(4, SetTemperatureCommand(thermostat, 25),
+                       SetTemperatureCommand(thermostat, 18))
+
+    checkpoints = {presses // 8, presses // 2, presses}
+    stdout = sys.stdout
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        gc.collect()
+        tracemalloc.start()
+        try:
+            for i in range(1, presses + 1):
+                # Серии нажатий по одному слоту сворачиваются в одну запись.
+                slot = (i // 3) % 5
+                if i % 2:
+                    remote.press_on_button(slot)
+                else:
+                    remote.press_off_button(slot)
+                if i in checkpoints:
+                    current = tracemalloc.get_traced_memory()[0]
+                    print(f"{i} нажатий: {current / 1024:.1f} КБ, "
+                          f"записей отмены {len(remote.undo_stack)}",
+                          file=stdout)
+        finally:
+            tracemalloc.stop()
 
 
 def main():
@@ -228,6 +1096,93 @@ def main():
 
     remote.show_history()
 
+    print("\n=== Параллельная макрокоманда ===")
+    party_mode = MacroCommand([
+        LightOnCommand(living_room_light),
+        LightOnCommand(bedroom_light),
+        SetTemperatureCommand(thermostat, 23),
+    ], parallel=True)
+    party_mode.execute()
+    print("Порядок завершения:",
+          [command.__class__.__name__
+           for command in party_mode.executed_commands])
+    party_mode.undo()
+    party_mode.close()
+
+    print("\n=== Журнал команд и восстановление ===")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "remote.journal")
+
+        def build_remote(journal: CommandJournal):
+            hall_light = Light("прихожей")
+            hall_thermostat = Thermostat("прихожей")
+            journaled = RemoteControl(journal=journal)
+            journaled.set_command(0, LightOnCommand(hall_light),
+                                  LightOffCommand(hall_light))
+            journaled.set_command(1,
+                                  SetTemperatureCommand(hall_thermostat, 24),
+                                  SetTemperatureCommand(hall_thermostat, 18))
+            return journaled, hall_light, hall_thermostat
+
+        journaled, _, _ = build_remote(
+            CommandJournal(path, checkpoint_every=3))
+        journaled.press_on_button(0)
+        journaled.press_on_button(1)
+        journaled.press_off_button(1)
+        journaled.press_undo()
+        journaled.press_off_button(0)
+        journaled.journal.close()
+
+        restored, hall_light, hall_thermostat = build_remote(
+            CommandJournal(path, checkpoint_every=3))
+        replayed = restored.recover()
+        print(f"Повторено записей после контрольной точки: {replayed}")
+        print(f"Свет включен: {hall_light.is_on}, "
+              f"температура: {hall_thermostat.temperature}°C, "
+              f"в стеке отмены: {len(restored.undo_stack)}")
+        restored.press_undo()
+        restored.press_undo()
+        print(f"После двух отмен: свет включен: {hall_light.is_on}, "
+              f"температура: {hall_thermostat.temperature}°C")
+
+    print("\n=== Очередь с объединением команд ===")
+    queued_remote = RemoteControl(queued=True)
+    queued_remote.set_command(0, living_room_light_on, living_room_light_off)
+    queued_remote.set_command(1, bedroom_light_on, bedroom_light_off)
+    queued_remote.set_command(2, set_warm_temp, set_cool_temp)
+    queued_remote.press_on_button(0)
+    queued_remote.press_off_button(0)
+    queued_remote.press_on_button(2)
+    queued_remote.press_off_button(2)
+    queued_remote.press_on_button(1)
+    print(f"Команд в очереди: {len(queued_remote.queue)}")
+    queued_remote.flush()
+    queued_remote.press_undo()
+    queued_remote.close()
+    check_queued_undo()
+
+
+def benchmark_journal(presses: int = 100000) -> None:
+    """Время записи нажатия в журнал при групповом fsync."""
+    with tempfile.TemporaryDirectory() as directory:
+        journal = CommandJournal(os.path.join(directory, "bench.journal"),
+                                 fsync="group", group_size=256)
+        start = time.perf_counter()
+        for i in range(presses):
+            journal.append(JournalOp.ON, i % 8)
+        elapsed = time.perf_counter() - start
+        journal.close()
+    print(f"Запись в журнал: {elapsed / presses * 1e6:.2f} мкс на нажатие")
+
+
+def run_benchmarks():
+    benchmark_journal()
+    benchmark_history_memory()
+    benchmark_undo_memory()
+
 
 if __name__ == "__main__":
-    main()
+    if "--bench" in sys.argv:
+        run_benchmarks()
+    else:
+        main()
@@ -22,35 +22,163 @@
 
 
 from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from typing import (Any, Callable, Dict, FrozenSet, Hashable, Iterable,
+                    Iterator, List, Optional, Sequence, Set, Tuple)
+import json
+import random
+import re
+import sys
+import sqlite3
+import time
+import timeit
+
+try:
+    import numpy as np
+except ImportError:  # NumPy не обязателен, колонки могут быть списками
+    np = None
+
+
+def _is_numpy(columns: Dict[str, Sequence]) -> bool:
+    return np is not None and all(
+        isinstance(column, np.ndarray) for column in columns.values())
+
+
+def _column(columns: Dict[str, Sequence], name: str,
+            rows: Optional[Sequence[int]]) -> Sequence:
+    """Колонка целиком или только строки rows."""
+    column = columns[name]
+    if rows is None:
+        return column
+    if np is not None and isinstance(column, np.ndarray):
+        return column[rows]
+    return [column[i] for i in rows]
+
+
+class _CodeGen:
+    """Контекст генерации кода: константы и объекты передаются по имени."""
+
+    def __init__(self):
+        self.namespace: Dict[str, Any] = {}
+
+    def bind(self, value: Any) -> str:
+        name = f"_c{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
 
 
 class Expr(ABC):
     """Абстрактный базовый класс."""
 
+    # Оценка стоимости одной проверки в условных единицах.
+    cost = 1.0
+
     @abstractmethod
     def check(self, data):
         pass
 
+    def compile(self) -> Callable[[dict], Any]:
+        """
+        Компилирует дерево в одну функцию от записи.
+
+        Результат совпадает с ``check``, но дерево обходится один раз
+        при компиляции, а не на каждой записи.
+        """
+        gen = _CodeGen()
+        source = f"lambda data: {self._emit(gen)}"
+        return eval(compile(source, "<expr>", "eval"), gen.namespace)
+
+    def key(self) -> Hashable:
+        """
+        Структурный ключ: равен у одинаковых по смыслу выражений.
+
+        По умолчанию выражение равно только самому себе.
+        """
+        return ("Expr", id(self))
+
+    def _emit(self, gen: _CodeGen) -> str:
+        """Python-выражение от ``data``; по умолчанию вызывает check."""
+        return f"{gen.bind(self.check)}(data)"
+
+    def check_batch(self, columns: Dict[str, Sequence],
+                    rows: Optional[Sequence[int]] = None):
+        """
+        Проверяет сразу много записей, заданных колонками.
+
+        ``columns`` - словарь имя -> список или массив NumPy. Если задан
+        ``rows``, проверяются только эти строки. Возвращает булеву маску
+        (массив NumPy для колонок NumPy, иначе список) по строкам.
+        По умолчанию собирает записи и вызывает check.
+        """
+        names = list(columns)
+        if rows is None:
+            rows = range(len(columns[names[0]])) if names else range(0)
+        mask = [bool(self.check({name: columns[name][i] for name in names}))
+                for i in rows]
+        return np.array(mask, dtype=bool) if _is_numpy(columns) else mask
+
 
 class AgeGreater(Expr):
     """Проверка возраста."""
 
+    cost = 1.0
+
     def __init__(self, age: int):
         self.age = age
+
+    def __repr__(self) -> str:
+        return f"AgeGreater({self.age!r})"
+
+    def key(self) -> Hashable:
+        return ("AgeGreater", self.age)
     
     def check(self, data: dict):
         return data['age'] > self.age
 
+    def _emit(self, gen: _CodeGen) -> str:
+        return f"(data['age'] > {gen.bind(self.age)})"
+
+    def check_batch(self, columns: Dict[str, Sequence],
+                    rows: Optional[Sequence[int]] = None):
+        ages = _column(columns, "age", rows)
+        if np is not None and isinstance(ages, np.ndarray):
+            return ages > self.age
+        age = self.age
+        return [value > age for value in ages]
+
 
 class NameContains(Expr):
     """Проверка имени."""
 
+    # Поиск подстроки заметно дороже сравнения чисел.
+    cost = 4.0
+
     def __init__(self, text: str):
         self.text = text
+
+    def __repr__(self) -> str:
+        return f"NameContains({self.text!r})"
+
+    def key(self) -> Hashable:
+        return ("NameContains", self.text)
     
     def check(self, data: dict):
         return self.text in data["name"]
 
+    def _emit(self, gen: _CodeGen) -> str:
+        return f"({gen.bind(self.text)} in data['name'])"
+
+    def check_batch(self, columns: Dict[str, Sequence],
+                    rows: Optional[Sequence[int]] = None):
+        names = _column(columns, "name", rows)
+        if np is not None and isinstance(names, np.ndarray):
+            if names.dtype.kind != "U":
+                names = names.astype(str)
+            return np.char.find(names, self.text) >= 0
+        text = self.text
+        return [text in value for value in names]
+
 
 class And(Expr):
     """Условие."""
@@ -58,16 +186,879 @@ class And(Expr):
     def __init__(self, left: Expr, right: Expr):
         self.left = left
         self.right = right
+
+    def __repr__(self) -> str:
+        return f"And({self.left!r}, {self.right!r})"
+
+    def key(self) -> Hashable:
+        # Порядок и вложенность операндов And на результат не влияют.
+        return ("And", frozenset(operand.key()
+                                 for operand in _conjuncts(self)))
     
     def check(self, person: dict):
         return self.left.check(person) and self.right.check(person)
 
+    def operands(self) -> List[Expr]:
+        """Операнды вложенных And слева направо."""
+        result = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, And):
+                stack.append(node.right)
+                stack.append(node.left)
+            else:
+                result.append(node)
+        return result
+
+    def _emit(self, gen: _CodeGen) -> str:
+        # "and" ассоциативен, поэтому вложенные And разворачиваются
+        # в одну плоскую цепочку без лишней вложенности скобок.
+        return "(" + " and ".join(
+            operand._emit(gen) for operand in self.operands()) + ")"
+
+    def check_batch(self, columns: Dict[str, Sequence],
+                    rows: Optional[Sequence[int]] = None):
+        # Правый операнд проверяет только строки, прошедшие левый.
+        left = self.left.check_batch(columns, rows)
+        if _is_numpy(columns):
+            left = np.asarray(left, dtype=bool)
+            if rows is None:
+                rows = np.arange(len(left))
+            survivors = np.asarray(rows)[left]
+            mask = left.copy()
+            if len(survivors):
+                mask[left] = np.asarray(
+                    self.right.check_batch(columns, survivors), dtype=bool)
+            return mask
+
+        if rows is None:
+            rows = range(len(left))
+        survivors = [row for row, passed in zip(rows, left) if passed]
+        right = iter(self.right.check_batch(columns, survivors)
+                     if survivors else ())
+        return [bool(passed) and bool(next(right)) for passed in left]
+
+
+class AdaptiveAnd(Expr):
+    """
+    Конъюнкция с переупорядочиваемыми операндами и счетчиками.
+
+    Операнды проверяются в переданном порядке до первого вызова replan.
+    После него операнды проверяются в порядке возрастания ранга
+    cost / (1 - selectivity): дешевые и отсекающие больше записей идут
+    первыми. Счетчики ``evaluations`` и ``passes`` показывают, сколько раз
+    операнд вычислялся и сколько раз был истинным. При ``replan_every > 0``
+    порядок пересчитывается по счетчикам каждые replan_every проверок.
+    Результат совпадает с And по истинности (check возвращает bool).
+    """
+
+    def __init__(self, operands: List[Expr], replan_every: int = 0,
+                 selectivity: Optional[List[float]] = None):
+        self._operands = list(operands)
+        self.replan_every = replan_every
+        self.selectivity = (list(selectivity) if selectivity is not None
+                            else [0.5] * len(self._operands))
+        self.evaluations = [0] * len(self._operands)
+        self.passes = [0] * len(self._operands)
+        self._checks = 0
+        self._order = list(range(len(self._operands)))
+
+    def __repr__(self) -> str:
+        ordered = ", ".join(repr(self._operands[i]) for i in self._order)
+        return f"AdaptiveAnd([{ordered}])"
+
+    def operands(self) -> List[Expr]:
+        """Операнды в исходном порядке."""
+        return list(self._operands)
+
+    def key(self) -> Hashable:
+        return ("And", frozenset(operand.key()
+                                 for operand in _conjuncts(self)))
+
+    def _rank(self, i: int) -> float:
+        if self.evaluations[i]:
+            selectivity = self.passes[i] / self.evaluations[i]
+        else:
+            selectivity = self.selectivity[i]
+        if selectivity >= 1.0:
+            return float("inf")
+        return self._operands[i].cost / (1.0 - selectivity)
+
+    def replan(self) -> None:
+        """Пересчитывает порядок операндов по стоимости и селективности."""
+        self._order.sort(key=self._rank)
+
+    def check(self, data):
+        self._checks += 1
+        if self.replan_every and self._checks % self.replan_every == 0:
+            self.replan()
+        for i in self._order:
+            self.evaluations[i] += 1
+            if not self._operands[i].check(data):
+                return False
+            self.passes[i] += 1
+        return True
+
+    def _emit(self, gen: _CodeGen) -> str:
+        if self.replan_every:
+            return super()._emit(gen)
+        # Без адаптации порядок фиксирован и компилируется без счетчиков.
+        return "bool(" + " and ".join(
+            self._operands[i]._emit(gen) for i in self._order) + ")"
+
+    def check_batch(self, columns: Dict[str, Sequence],
+                    rows: Optional[Sequence[int]] = None):
+        numpy = _is_numpy(columns)
+        if rows is None:
+            names = list(columns)
+            rows = range(len(columns[names[0]])) if names else range(0)
+        # Позиции строк из rows, прошедших все операнды до текущего.
+        if numpy:
+            rows = np.asarray(rows)
+            alive = np.arange(len(rows))
+        else:
+            alive = list(range(len(rows)))
+        for i in self._order:
+            if not len(alive):
+                break
+            self.evaluations[i] += len(alive)
+            if numpy:
+                mask = np.asarray(
+                    self._operands[i].check_batch(columns, rows[alive]),
+                    dtype=bool)
+                alive = alive[mask]
+            else:
+                mask = self._operands[i].check_batch(
+                    columns, [rows[position] for position in alive])
+                alive = [position for position, passed in zip(alive, mask)
+                         if passed]
+            self.passes[i] += len(alive)
+
+        if numpy:
+            result = np.zeros(len(rows), dtype=bool)
+            result[alive] = True
+            return result
+        result = [False] * len(rows)
+        for position in alive:
+            result[position] = True
+        return result
+
+    def stats(self) -> List[tuple]:
+        """(операнд, вычислений, истинных) в текущем порядке проверки."""
+        return [(self._operands[i], self.evaluations[i], self.passes[i])
+                for i in self._order]
+
+
+def _conjuncts(expr: Expr) -> List[Expr]:
+    """Операнды конъюнкции с раскрытием вложенных And и AdaptiveAnd."""
+    if isinstance(expr, (And, AdaptiveAnd)):
+        operands = expr.operands()
+    else:
+        return [expr]
+    return [leaf for operand in operands for leaf in _conjuncts(operand)]
+
+
+def plan(expr: Expr, sample: Optional[List[dict]] = None,
+         replan_every: int = 0) -> Expr:
+    """
+    Переупорядочивает операнды вложенных And.
+
+    Без выборки порядок задается только стоимостью операндов. С выборкой
+    ``sample`` селективность каждого операнда измеряется на ней.
+    Выражения без And возвращаются как есть.
+    """
+    if not isinstance(expr, And):
+        return expr
+    operands = [plan(operand, sample, replan_every)
+                for operand in expr.operands()]
+    selectivity = None
+    if sample:
+        selectivity = [
+            sum(1 for record in sample if operand.check(record)) / len(sample)
+            for operand in operands
+        ]
+    planned = AdaptiveAnd(operands, replan_every, selectivity)
+    planned.replan()
+    return planned
+
+
+class RecordStore:
+    """
+    Хранилище записей с вторичными индексами для фильтров.
+
+    Отсортированный индекс по ``age`` превращает AgeGreater в бинарный
+    поиск, n-граммный индекс по ``name`` отвечает на NameContains
+    пересечением списков вхождений, а And - пересечением кандидатов.
+    Узлы, которые индексы не покрывают, проверяются через check
+    на кандидатах или полным просмотром. Индексы обновляются
+    при каждой вставке и удалении.
+    """
+
+    def __init__(self, ngram: int = 2):
+        self.ngram = ngram
+        self._records: Dict[int, dict] = {}
+        self._next_id = 0
+        self._ages: List[Tuple[Any, int]] = []
+        self._grams: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _name_grams(self, name: str) -> Set[str]:
+        if len(name) < self.ngram:
+            return {name}
+        return {name[i:i + self.ngram]
+                for i in range(len(name) - self.ngram + 1)}
+
+    def insert(self, record: dict) -> int:
+        """Добавляет запись и возвращает ее идентификатор."""
+        record_id = self._next_id
+        self._next_id += 1
+        self._records[record_id] = record
+        insort(self._ages, (record["age"], record_id))
+        for gram in self._name_grams(record["name"]):
+            self._grams.setdefault(gram, set()).add(record_id)
+        return record_id
+
+    def delete(self, record_id: int) -> None:
+        record = self._records.pop(record_id)
+        position = bisect_left(self._ages, (record["age"], record_id))
+        del self._ages[position]
+        for gram in self._name_grams(record["name"]):
+            postings = self._grams[gram]
+            postings.discard(record_id)
+            if not postings:
+                del self._grams[gram]
+
+    def get(self, record_id: int) -> dict:
+        return self._records[record_id]
+
+    def _candidates(self, expr: Expr) -> Tuple[Optional[Set[int]], bool]:
+        """
+        Кандидаты из индексов и признак точности.
+
+        None - индексы не помогают. Неточный ответ (False) содержит все
+        подходящие записи, но его нужно перепроверить через check.
+        """
+        if isinstance(expr, AgeGreater):
+            start = bisect_right(self._ages, (expr.age, float("inf")))
+            return {record_id for _, record_id in self._ages[start:]}, True
+        if isinstance(expr, NameContains):
+            if len(expr.text) < self.ngram:
+                return None, False
+            postings = sorted(
+                (self._grams.get(gram, set())
+                 for gram in self._name_grams(expr.text)), key=len)
+            return postings[0].intersection(*postings[1:]), False
+        if isinstance(expr, (And, AdaptiveAnd)):
+            result: Optional[Set[int]] = None
+            exact = True
+            for operand in expr.operands():
+                ids, operand_exact = self._candidates(operand)
+                if ids is None:
+                    exact = False
+                    continue
+                exact = exact and operand_exact
+                result = ids if result is None else result & ids
+                if not result:
+                    return result, True
+            return result, exact and result is not None
+        return None, False
+
+    def query_ids(self, expr: Expr) -> List[int]:
+        """Идентификаторы записей, удовлетворяющих фильтру, по возрастанию."""
+        ids, exact = self._candidates(expr)
+        if ids is None:
+            return [record_id for record_id, record in self._records.items()
+                    if expr.check(record)]
+        if not exact:
+            ids = [record_id for record_id in ids
+                   if expr.check(self._records[record_id])]
+        return sorted(ids)
+
+    def query(self, expr: Expr) -> List[dict]:
+        """Записи, удовлетворяющие фильтру, в порядке вставки."""
+        return [self._records[record_id] for record_id in self.query_ids(expr)]
+
+
+class SQLiteStore:
+    """
+    Хранилище записей в SQLite с переносом фильтров в SQL.
+
+    AgeGreater, NameContains и And переводятся в параметризованный
+    WHERE: возраст ищется по индексу, подстрока имени - через
+    триграммный индекс FTS5, если SQLite его поддерживает. Узлы,
+    которые нельзя перевести, проверяются в Python на строках,
+    которые вернул SQL. Результаты отдаются потоком.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS people (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                age INTEGER NOT NULL,
+                extra TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS people_age ON people (age);
+        """)
+        try:
+            self._connection.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS people_fts USING fts5(
+                    name, content='people', content_rowid='id',
+                    tokenize='trigram case_sensitive 1');
+                CREATE TRIGGER IF NOT EXISTS people_fts_insert
+                AFTER INSERT ON people BEGIN
+                    INSERT INTO people_fts (rowid, name)
+                    VALUES (new.id, new.name);
+                END;
+                CREATE TRIGGER IF NOT EXISTS people_fts_delete
+                AFTER DELETE ON people BEGIN
+                    INSERT INTO people_fts (people_fts, rowid, name)
+                    VALUES ('delete', old.id, old.name);
+                END;
+            """)
+            self._trigrams = True
+        except sqlite3.OperationalError:
+            # Сборка SQLite без FTS5 или триграммного токенизатора.
+            self._trigrams = False
+
+    def insert_many(self, records: Iterable[dict]) -> None:
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO people (name, age, extra) VALUES (?, ?, ?)",
+                (self._row(record) for record in records))
+
+    def insert(self, record: dict) -> int:
+        """Добавляет запись и возвращает ее идентификатор."""
+        with self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO people (name, age, extra) VALUES (?, ?, ?)",
+                self._row(record))
+        return cursor.lastrowid
+
+    def delete(self, record_id: int) -> None:
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM people WHERE id = ?", (record_id,))
+
+    @staticmethod
+    def _row(record: dict) -> tuple:
+        extra = {key: value for key, value in record.items()
+                 if key not in ("name", "age")}
+        return record["name"], record["age"], json.dumps(extra,
+                                                         ensure_ascii=False)
+
+    def _translate(self, expr: Expr) -> Optional[Tuple[str, list]]:
+        """Условие WHERE с параметрами или None, если узел не переводится."""
+        if isinstance(expr, AgeGreater):
+            return "age > ?", [expr.age]
+        if isinstance(expr, NameContains):
+            # instr совпадает с оператором in, индекс FTS лишь сужает
+            # поиск и работает для подстрок от трех символов.
+            if self._trigrams and len(expr.text) >= 3:
+                phrase = '"' + expr.text.replace('"', '""') + '"'
+                return ("id IN (SELECT rowid FROM people_fts "
+                        "WHERE people_fts MATCH ?) AND instr(name, ?) > 0",
+                        [phrase, expr.text])
+            return "instr(name, ?) > 0", [expr.text]
+        return None
+
+    def split(self, expr: Expr) -> Tuple[Optional[str], list, List[Expr]]:
+        """Делит фильтр на WHERE для SQLite и операнды для проверки в Python."""
+        clauses, params, residual = [], [], []
+        for operand in _conjuncts(expr):
+            translated = self._translate(operand)
+            if translated is None:
+                residual.append(operand)
+            else:
+                clauses.append(translated[0])
+                params.extend(translated[1])
+        where = " AND ".join(f"({clause})" for clause in clauses) or None
+        return where, params, residual
+
+    def query(self, expr: Expr) -> Iterator[dict]:
+        """Потоком отдает записи, удовлетворяющие фильтру, в порядке вставки."""
+        where, params, residual = self.split(expr)
+        sql = "SELECT name, age, extra FROM people"
+        if where:
+            sql += " WHERE " + where
+        sql += " ORDER BY id"
+        for name, age, extra in self._connection.execute(sql, params):
+            record = {"name": name, "age": age, **json.loads(extra)}
+            if all(operand.check(record) for operand in residual):
+                yield record
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class FilterSyntaxError(ValueError):
+    """Ошибка в тексте фильтра."""
+
+
+# Грамматика языка фильтров:
+#     filter := term ("and" term)*
+#     term   := "(" filter ")" | "age" ">" INT | "name" "contains" STRING
+# Ключевые слова не зависят от регистра, строки - в двойных кавычках
+# с экранированием через обратную косую черту.
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<int>-?\d+)
+      | "(?P<str>(?:[^"\\]|\\.)*)"
+      | (?P<word>[A-Za-z_]+)
+      | (?P<op>[>()])
+    )""", re.VERBOSE)
+
+
+def _tokenize(text: str) -> List[Tuple[str, Any]]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise FilterSyntaxError(
+                f"Неожиданный символ в позиции {position}: {text[position]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "int":
+            value = int(value)
+        elif kind == "str":
+            value = re.sub(r"\\(.)", r"\1", value)
+        elif kind == "word":
+            value = value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+def _normalize(tokens: List[Tuple[str, Any]]) -> str:
+    """Каноничный текст фильтра: одинаков для равных по смыслу записей."""
+    parts = []
+    for kind, value in tokens:
+        if kind == "str":
+            escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+            parts.append(f'"{escaped}"')
+        else:
+            parts.append(str(value))
+    return " ".join(parts)
+
+
+class _Parser:
+    """Рекурсивный спуск по списку токенов."""
+
+    _KINDS = {"int": "число", "str": "строка", "word": "слово", "op": "оператор"}
+
+    def __init__(self, tokens: List[Tuple[str, Any]]):
+        self.tokens = tokens
+        self.position = 0
+
+    def _peek(self) -> Optional[Tuple[str, Any]]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def _expect(self, kind: str, value: Any = None) -> Any:
+        token = self._peek()
+        if token is None or token[0] != kind or (
+                value is not None and token[1] != value):
+            expected = value if value is not None else self._KINDS[kind]
+            raise FilterSyntaxError(
+                f"Ожидалось {expected!r}, получено "
+                f"{token[1] if token else 'конец строки'!r}")
+        self.position += 1
+        return token[1]
+
+    def parse(self) -> Expr:
+        expr = self._filter()
+        if self._peek() is not None:
+            raise FilterSyntaxError(f"Лишний токен {self._peek()[1]!r}")
+        return expr
+
+    def _filter(self) -> Expr:
+        expr = self._term()
+        while self._peek() == ("word", "and"):
+            self.position += 1
+            expr = And(expr, self._term())
+        return expr
+
+    def _term(self) -> Expr:
+        token = self._peek()
+        if token == ("op", "("):
+            self.position += 1
+            expr = self._filter()
+            self._expect("op", ")")
+            return expr
+        if token == ("word", "age"):
+            self.position += 1
+            self._expect("op", ">")
+            return AgeGreater(self._expect("int"))
+        if token == ("word", "name"):
+            self.position += 1
+            self._expect("word", "contains")
+            return NameContains(self._expect("str"))
+        raise FilterSyntaxError(
+            f"Ожидалось условие, получено "
+            f"{token[1] if token else 'конец строки'!r}")
+
+
+def parse_filter(text: str) -> Expr:
+    """Разбирает текст вида 'age > 20 and name contains "Ив"' в дерево Expr."""
+    return _Parser(_tokenize(text)).parse()
+
+
+class FilterCache:
+    """
+    LRU-кеш разобранных и оптимизированных фильтров.
+
+    Ключ - нормализованный текст фильтра, поэтому записи, отличающиеся
+    только пробелами или регистром ключевых слов, разделяют одну запись
+    кеша. Сначала фильтр ищется по исходному тексту без разбора, и
+    только при промахе текст токенизируется и нормализуется.
+    parse_time включает токенизацию, разбор и планирование.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._cache: "OrderedDict[str, Expr]" = OrderedDict()
+        # Исходный текст -> нормализованный ключ.
+        self._aliases: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.parses = 0
+        self.parse_time = 0.0
+
+    def get(self, text: str) -> Expr:
+        key = self._aliases.get(text)
+        if key is not None:
+            expr = self._cache.get(key)
+            if expr is not None:
+                self._aliases.move_to_end(text)
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return expr
+
+        start = time.perf_counter()
+        tokens = _tokenize(text)
+        key = _normalize(tokens)
+        expr = self._cache.get(key)
+        if expr is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            expr = plan(_Parser(tokens).parse())
+            self._cache[key] = expr
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        self.parse_time += time.perf_counter() - start
+        self.parses += 1
+        self._aliases[text] = key
+        if len(self._aliases) > self.maxsize:
+            self._aliases.popitem(last=False)
+        return expr
+
+    def stats(self) -> Dict[str, float]:
+        """Метрики кеша: попадания, промахи, доля попаданий и время разбора."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._cache),
+            "hit_rate": self.hits / total if total else 0.0,
+            "parse_time": self.parse_time,
+            "mean_parse_time": (self.parse_time / self.parses
+                                if self.parses else 0.0),
+        }
+
+
+class FilterSet:
+    """
+    Набор фильтров, проверяемых вместе (публикация/подписка).
+
+    Каждый фильтр раскладывается на конъюнкцию предикатов, одинаковые
+    предикаты объединяются по структурному ключу, а фильтры с одинаковым
+    набором предикатов - в одну группу. На каждой записи каждый
+    различный предикат вычисляется один раз, так что стоимость растет
+    с числом различных предикатов, а не фильтров. У предиката есть
+    счетчик использующих его фильтров; когда он обнуляется, предикат
+    удаляется, а его номер отдается следующему новому предикату.
+    """
+
+    def __init__(self):
+        self._predicates: Dict[Hashable, int] = {}
+        # Номер предиката -> предикат, None - свободный номер.
+        self._leaves: List[Optional[Expr]] = []
+        self._refs: List[int] = []
+        self._free: List[int] = []
+        self._filters: Dict[Any, FrozenSet[int]] = {}
+        self._order: Dict[Any, int] = {}
+        self._sequence = 0
+        self._groups: Dict[FrozenSet[int], List[Any]] = {}
+        self._evaluate: Optional[Callable[[dict], tuple]] = None
+        self._by_leaf: List[List[FrozenSet[int]]] = []
+
+    def __len__(self) -> int:
+        return len(self._filters)
+
+    @property
+    def distinct_predicates(self) -> int:
+        return len(self._predicates)
+
+    def add(self, name: Any, expr: Expr) -> None:
+        """Регистрирует фильтр под именем name, заменяя прежний."""
+        if name in self._filters:
+            self.remove(name)
+        leaves = set()
+        for leaf in _conjuncts(expr):
+            key = leaf.key()
+            index = self._predicates.get(key)
+            if index is None:
+                if self._free:
+                    index = self._free.pop()
+                    self._leaves[index] = leaf
+                else:
+                    index = len(self._leaves)
+                    self._leaves.append(leaf)
+                    self._refs.append(0)
+                self._predicates[key] = index
+            leaves.add(index)
+        group = frozenset(leaves)
+        for index in group:
+            self._refs[index] += 1
+        self._filters[name] = group
+        self._order[name] = self._sequence
+        self._sequence += 1
+        self._groups.setdefault(group, []).append(name)
+        self._evaluate = None
+
+    def remove(self, name: Any) -> None:
+        group = self._filters.pop(name)
+        del self._order[name]
+        names = self._groups[group]
+        names.remove(name)
+        if not names:
+            del self._groups[group]
+        for index in group:
+            self._refs[index] -= 1
+            if not self._refs[index]:
+                del self._predicates[self._leaves[index].key()]
+                self._leaves[index] = None
+                self._free.append(index)
+        self._evaluate = None
+
+    def _compile(self) -> None:
+        live = [index for index, leaf in enumerate(self._leaves)
+                if leaf is not None]
+        gen = _CodeGen()
+        source = "lambda data: (" + "".join(
+            f"{self._leaves[index]._emit(gen)}, " for index in live) + ")"
+        self._evaluate = eval(compile(source, "<filters>", "eval"),
+                              gen.namespace)
+        # Позиция в кортеже _evaluate -> группы, использующие предикат.
+        position = {index: i for i, index in enumerate(live)}
+        self._by_leaf = [[] for _ in live]
+        for group in self._groups:
+            for index in group:
+                self._by_leaf[position[index]].append(group)
+
+    def match(self, record: dict) -> List[Any]:
+        """Имена фильтров, которым удовлетворяет запись, в порядке регистрации."""
+        if self._evaluate is None:
+            self._compile()
+        counts: Dict[FrozenSet[int], int] = {}
+        for index, value in enumerate(self._evaluate(record)):
+            if value:
+                for group in self._by_leaf[index]:
+                    counts[group] = counts.get(group, 0) + 1
+        matched = [name for group, count in counts.items()
+                   if count == len(group) for name in self._groups[group]]
+        matched.sort(key=self._order.__getitem__)
+        return matched
+
+
+def benchmark_filter_set(filters: int = 5000, records: int = 200) -> None:
+    """Сравнивает FilterSet с проверкой каждого фильтра по отдельности."""
+    rng = random.Random(0)
+    predicates = ([AgeGreater(age) for age in range(0, 100, 5)]
+                  + [NameContains(text) for text in
+                     ("Ив", "Ан", "ар", "ер", "на", "ол", "ия", "ан")])
+    exprs = {}
+    for i in range(filters):
+        operands = rng.sample(predicates, rng.randint(1, 3))
+        expr = operands[0]
+        for operand in operands[1:]:
+            expr = And(expr, operand)
+        exprs[f"f{i}"] = expr
+    filter_set = FilterSet()
+    for name, expr in exprs.items():
+        filter_set.add(name, expr)
+
+    names = ["Иван", "Анна", "Мария", "Петр", "Ольга", "Наталия"]
+    people = [{"name": rng.choice(names), "age": rng.randint(0, 99)}
+              for _ in range(records)]
+    for person in people:
+        assert filter_set.match(person) == [
+            name for name, expr in exprs.items() if expr.check(person)]
+
+    naive = min(timeit.repeat(
+        lambda: [[name for name, expr in exprs.items() if expr.check(p)]
+                 for p in people], number=1, repeat=3))
+    shared = min(timeit.repeat(
+        lambda: [filter_set.match(p) for p in people], number=1, repeat=3))
+    print(f"{filters} фильтров, {filter_set.distinct_predicates} различных "
+          f"предикатов: по отдельности {naive / records * 1e6:.0f} мкс, "
+          f"FilterSet {shared / records * 1e6:.0f} мкс на запись")
+
+
+def benchmark_index(records: int = 300000) -> None:
+    """Сравнивает запросы через индексы с полным просмотром."""
+    first_names = ["Иван", "Петр", "Мария", "Анна", "Олег", "Ивета"]
+    people = [{"name": f"{first_names[i % 6]}{i}", "age": i % 90}
+              for i in range(records)]
+    store = RecordStore()
+    for person in people:
+        store.insert(person)
+
+    for expr in (AgeGreater(85), NameContains("Ивета1234"),
+                 And(AgeGreater(80), NameContains("ета")),
+                 And(AgeGreater(60), NameContains("ария12"))):
+        scan = min(timeit.repeat(
+            lambda: [p for p in people if expr.check(p)], number=1, repeat=3))
+        indexed = min(timeit.repeat(
+            lambda: store.query(expr), number=1, repeat=3))
+        assert store.query(expr) == [p for p in people if expr.check(p)]
+        print(f"{expr!r}: просмотр {scan * 1e3:.1f} мс, "
+              f"индекс {indexed * 1e3:.1f} мс")
+
+
+def benchmark_check_batch(records: int = 200000) -> None:
+    """Сравнивает check_batch с циклом по check."""
+    ages = [i % 100 for i in range(records)]
+    names = [("Иван" if i % 3 else "Петр") + str(i) for i in range(records)]
+    people = [{"name": name, "age": age} for name, age in zip(names, ages)]
+    expr = And(AgeGreater(60), NameContains("Ив"))
+
+    loop = min(timeit.repeat(
+        lambda: [expr.check(p) for p in people], number=1, repeat=3))
+    print(f"Цикл по check: {loop * 1e3:.1f} мс")
+
+    columns = {"age": ages, "name": names}
+    assert expr.check_batch(columns) == [expr.check(p) for p in people]
+    batch = min(timeit.repeat(
+        lambda: expr.check_batch(columns), number=1, repeat=3))
+    print(f"check_batch по спискам: {batch * 1e3:.1f} мс")
+
+    if np is not None:
+        arrays = {"age": np.array(ages), "name": np.array(names)}
+        assert expr.check_batch(arrays).tolist() == expr.check_batch(columns)
+        vector = min(timeit.repeat(
+            lambda: expr.check_batch(arrays), number=1, repeat=3))
+        print(f"check_batch по массивам NumPy: {vector * 1e3:.1f} мс")
+
+
+def benchmark_compile(depths=(1, 4, 16, 64), records: int = 20000) -> None:
+    """Сравнивает обход дерева и скомпилированную функцию."""
+    people = [{"name": f"Иван {i}", "age": i % 100} for i in range(records)]
+    for depth in depths:
+        expr: Expr = AgeGreater(0)
+        for i in range(depth):
+            operand = NameContains("Ив") if i % 2 else AgeGreater(i % 10)
+            expr = And(expr, operand)
+        compiled = expr.compile()
+        assert [compiled(p) for p in people] == [expr.check(p) for p in people]
+
+        walk = min(timeit.repeat(
+            lambda: [expr.check(p) for p in people], number=1, repeat=3))
+        fast = min(timeit.repeat(
+            lambda: [compiled(p) for p in people], number=1, repeat=3))
+        print(f"Глубина {depth}: check {walk * 1e3:.1f} мс, "
+              f"compile {fast * 1e3:.1f} мс, ускорение {walk / fast:.1f}x")
+
 
 def main():
     person = {"name": "Иван", "age": 25}
     filter1 = And(AgeGreater(20), NameContains("Ив"))
     print(filter1.check(person))
+    print(filter1.compile()(person))
+
+    columns = {"name": ["Иван", "Петр", "Ивета"], "age": [25, 30, 19]}
+    print(filter1.check_batch(columns))
+
+    people = [{"name": ("Иван" if i % 2 else "Петр") + str(i),
+               "age": i % 100} for i in range(10000)]
+    naive = And(NameContains("Ив"), AgeGreater(90))
+    fixed = AdaptiveAnd(naive.operands())
+    planned = plan(naive, sample=people[:500])
+    assert ([fixed.check(p) for p in people]
+            == [planned.check(p) for p in people]
+            == [naive.check(p) for p in people])
+    for title, node in (("Исходный порядок", fixed), ("После плана", planned)):
+        print(title + ":")
+        total = 0.0
+        for operand, evaluations, passes in node.stats():
+            total += evaluations * operand.cost
+            print(f"    {operand!r}: вычислений {evaluations}, истинно {passes}")
+        print(f"    суммарная стоимость: {total:.0f}")
+
+    store = RecordStore()
+    for record in ({"name": "Иван", "age": 25}, {"name": "Ивета", "age": 19},
+                   {"name": "Петр", "age": 40}):
+        store.insert(record)
+    print(store.query(filter1))
+
+    filters = FilterCache(maxsize=128)
+    for text in ('age > 20 and name contains "Ив"',
+                 'AGE > 20   AND name contains "Ив"',
+                 '(name contains "Ив") and age > 20'):
+        expr = filters.get(text)
+        print(f"{text}: {expr!r} -> {expr.check(person)}")
+    print(filters.stats())
+
+    subscriptions = FilterSet()
+    subscriptions.add("взрослые", AgeGreater(18))
+    subscriptions.add("взрослые Ив", And(AgeGreater(18), NameContains("Ив")))
+    subscriptions.add("Ив взрослые", And(NameContains("Ив"), AgeGreater(18)))
+    subscriptions.add("старше 30", AgeGreater(30))
+    print(subscriptions.match(person),
+          f"различных предикатов: {subscriptions.distinct_predicates}")
+
+    class EvenAge(Expr):
+        """Условие, которое SQLite не умеет вычислять."""
+
+        def __repr__(self) -> str:
+            return "EvenAge()"
+
+        def check(self, data: dict):
+            return data["age"] % 2 == 0
+
+    first_names = ["Иван", "Ивета", "Анна", "Мария"]
+    people = [{"name": f"{first_names[i % 4]}{i}", "age": i % 70, "id": i}
+              for i in range(5000)]
+    sqlite_store = SQLiteStore()
+    sqlite_store.insert_many(people)
+    for expr in (filter1, And(AgeGreater(60), NameContains("вета1")),
+                 And(EvenAge(), NameContains("Ив"))):
+        where, _, residual = sqlite_store.split(expr)
+        found = list(sqlite_store.query(expr))
+        assert found == [p for p in people if expr.check(p)]
+        print(f"{expr!r}: SQL {where}, в Python {len(residual)} условий, "
+              f"найдено {len(found)}")
+    sqlite_store.close()
+
+
+def run_benchmarks():
+    benchmark_compile()
+    benchmark_check_batch()
+    benchmark_index()
+    benchmark_filter_set()
 
 
 if __name__ == "__main__":
-    main()
+    if "--bench" in sys.argv:
+        run_benchmarks()
+    else:
+        main()
@@ -16,35 +16,641 @@
     # Может быть избыточным
 
 
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from threading import Lock, Thread
+import asyncio
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import weakref
+
+
 class BookCollection:
-    """Коллекция книг."""
+    """
+    Коллекция книг.
+
+    Итераторы и chunks работают со снимком коллекции на момент своего
+    создания. add_book только дописывает в конец списка, поэтому снимку
+    достаточно запомнить список и его длину - это O(1) и без копирования.
+    remove_book не меняет список, а заменяет его копией (copy-on-write):
+    старые снимки держат прежний список, и он освобождается, когда
+    последний из них больше не нужен. Блокировка есть только между
+    писателями, читатели ее не берут.
+    """
 
     def __init__(self):
         self._books = []
+        self._write_lock = Lock()
     
     def add_book(self, book):
-        self._books.append(book)
+        with self._write_lock:
+            self._books.append(book)
+
+    def remove_book(self, book):
+        """Удаляет первую такую книгу, не затрагивая открытые снимки."""
+        with self._write_lock:
+            books = list(self._books)
+            books.remove(book)
+            self._books = books
+
+    def __len__(self):
+        return len(self._books)
+
+    def __getitem__(self, index):
+        return self._books[index]
+
+    def snapshot(self):
+        """Неизменяемое представление коллекции на текущий момент, O(1)."""
+        books = self._books
+        return BookSnapshot(books, len(books))
     
     def __iter__(self):
-        return BookIterator(self._books)
+        return iter(self.snapshot())
+
+    def __aiter__(self):
+        return self.async_iter()
+
+    def async_iter(self, page_size=256, prefetch=2):
+        """Асинхронный обход снимка с подкачкой страниц в фоне."""
+        return AsyncBookIterator(CollectionBookStorage(self),
+                                 page_size=page_size, prefetch=prefetch)
+
+    def chunks(self, size):
+        """Отдает книги списками по size штук."""
+        if size < 1:
+            raise ValueError("Размер пачки должен быть положительным")
+        view = self.snapshot()
+        for start in range(0, len(view), size):
+            yield view[start:start + size]
+
+    def _payload(self, view, start, stop):
+        """Данные диапазона книг снимка для передачи в процесс-воркер."""
+        return view[start:stop]
+
+    def map_parallel(self, fn, workers=None, ordered=True, chunk_size=None):
+        """
+        Применяет fn к каждой книге в пуле процессов.
+
+        Коллекция делится на диапазоны по chunk_size книг, каждый
+        обрабатывается в отдельном процессе целиком. При ordered=True
+        результаты идут в порядке книг, иначе - по мере готовности
+        диапазонов. fn должна быть доступна для pickle.
+        """
+        workers = workers or os.cpu_count() or 1
+        view = self.snapshot()
+        total = len(view)
+        if chunk_size is None:
+            chunk_size = max(1, -(-total // (workers * 4)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_map_range, fn,
+                                self._payload(view, start, start + chunk_size))
+                for start in range(0, total, chunk_size)
+            ]
+            for future in (futures if ordered else as_completed(futures)):
+                yield from future.result()
+
+
+class BookSnapshot:
+    """Первые length книг источника books; более поздние книги не видны."""
+
+    def __init__(self, books, length, page_size=None):
+        self._books = books
+        self._length = length
+        self._page_size = page_size
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step == 1:
+                return self._books[start:stop]
+            return [self._books[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("индекс книги вне диапазона")
+        return self._books[index]
+
+    def __iter__(self):
+        return BookIterator(self._books, page_size=self._page_size,
+                            stop=self._length)
+
+
+class _FileRange:
+    """
+    Диапазон книг файловой коллекции: в процесс передаются только путь
+    и номер поколения файлов, поэтому воркер читает те же файлы, что и
+    снимок, даже если коллекция тем временем изменилась.
+    """
+
+    def __init__(self, path, generation, start, stop):
+        self.path = path
+        self.generation = generation
+        self.start = start
+        self.stop = stop
+
+    def load(self):
+        data_map, index_map = _Generation(self.path, self.generation).map()
+        return _FileView(self.stop, data_map, index_map)[self.start:self.stop]
+
+
+def _map_range(fn, payload):
+    books = payload.load() if isinstance(payload, _FileRange) else payload
+    return [fn(book) for book in books]
+
+
+_OFFSET = struct.Struct("<Q")
+_MANIFEST = struct.Struct("<Q")
+# Смещений за один проход при перезаписи файла смещений.
+_REWRITE_CHUNK = 65536
+
+
+def _remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            # Файл уже удален вместе с каталогом или еще открыт (Windows).
+            pass
+
+
+class _Generation:
+    """
+    Файлы одного поколения коллекции: ``path.N`` и ``path.N.idx``.
+
+    Файлы поколения не перезаписываются. Выведенное из употребления
+    поколение удаляет их, когда на него не остается ссылок у снимков.
+    """
+
+    def __init__(self, path, number):
+        self.number = number
+        self.data_path = f"{path}.{number}"
+        self.index_path = f"{path}.{number}.idx"
+
+    def map(self):
+        """Отображения файлов данных и смещений только для чтения."""
+        with open(self.data_path, "rb") as data:
+            # Если все названия пустые, файл данных пуст, а пустой
+            # файл отобразить нельзя - читать из него и нечего.
+            if os.fstat(data.fileno()).st_size:
+                data_map = mmap.mmap(data.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+            else:
+                data_map = b""
+        with open(self.index_path, "rb") as index:
+            index_map = mmap.mmap(index.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        return data_map, index_map
+
+    def retire(self):
+        weakref.finalize(self, _remove_files, self.data_path, self.index_path)
+
+
+class _FileView:
+    """Первые count книг из отображений файлов данных и смещений."""
+
+    def __init__(self, count, data_map, index_map, generation=None):
+        self._count = count
+        self._data_map = data_map
+        self._index_map = index_map
+        # Держит поколение, чтобы его файлы не удалили, пока жив снимок.
+        self.generation = generation
+
+    def __len__(self):
+        return self._count
+
+    def _read(self, start, stop):
+        """Декодирует книги с номерами [start, stop)."""
+        if start >= stop:
+            return []
+        ends = struct.unpack_from(f"<{stop - start}Q", self._index_map,
+                                  start * _OFFSET.size)
+        begin = (_OFFSET.unpack_from(self._index_map,
+                                     (start - 1) * _OFFSET.size)[0]
+                 if start else 0)
+        books = []
+        for end in ends:
+            books.append(self._data_map[begin:end].decode("utf-8"))
+            begin = end
+        return books
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._count)
+            if step == 1:
+                return self._read(start, stop)
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("индекс книги вне диапазона")
+        return self._read(index, index + 1)[0]
+
+
+class FileBookCollection(BookCollection):
+    """
+    Коллекция книг в файле, отображенном в память.
+
+    Названия хранятся подряд в UTF-8 в файле ``path.N``, а в ``path.N.idx``
+    лежат смещения концов записей (по 8 байт), где N - номер поколения
+    из файла ``path``. Открытие не читает файл целиком, а доступ
+    по индексу или срезу декодирует только затронутые записи.
+    Итератор читает страницами по page_size книг.
+
+    remove_book пишет файлы следующего поколения и одним os.replace
+    подменяет номер в ``path``. Снимки держат прежнее поколение, поэтому,
+    как и в BookCollection, удаление их не затрагивает, а его файлы
+    удаляются вместе с последним снимком.
+    """
+
+    def __init__(self, path, page_size=1024):
+        self.path = path
+        self.page_size = page_size
+        number = 0
+        if os.path.exists(path):
+            with open(path, "rb") as manifest:
+                number, = _MANIFEST.unpack(manifest.read())
+        self._generation = _Generation(path, number)
+        self._data = open(self._generation.data_path, "ab")
+        self._index = open(self._generation.index_path, "ab")
+        if not os.path.exists(path):
+            self._write_manifest(number)
+        self._count = self._index.tell() // _OFFSET.size
+        self._size = self._data.tell()
+        self._maps = (0, None, None, None)
+        self._write_lock = Lock()
+        # Берется только при смене отображений, чтобы читатель не
+        # отобразил новый файл данных вместе со старым файлом смещений.
+        self._map_lock = Lock()
+
+    def add_book(self, book):
+        self.add_books((book,))
+
+    def add_books(self, books):
+        """Дописывает книги пачкой с одной записью на диск."""
+        with self._write_lock:
+            offsets = bytearray()
+            chunks = []
+            size = self._size
+            count = self._count
+            for book in books:
+                encoded = book.encode("utf-8")
+                chunks.append(encoded)
+                size += len(encoded)
+                offsets += _OFFSET.pack(size)
+                count += 1
+            self._data.write(b"".join(chunks))
+            self._index.write(offsets)
+            self._data.flush()
+            self._index.flush()
+            # Счетчик растет только после записи, поэтому читатель
+            # никогда не увидит книгу, которой еще нет в файле.
+            self._size = size
+            self._count = count
+
+    def remove_book(self, book):
+        """Удаляет первую такую книгу, не затрагивая открытые снимки."""
+        encoded = book.encode("utf-8")
+        with self._write_lock:
+            count, data_map, index_map, generation = self._mapped()
+            if not count:
+                raise ValueError("Книги нет в коллекции")
+            with memoryview(data_map) as data_view, \
+                    memoryview(index_map) as index_view, \
+                    index_view[:count * _OFFSET.size].cast("Q") as ends:
+                begin = 0
+                for position in range(count):
+                    end = ends[position]
+                    if data_view[begin:end] == encoded:
+                        break
+                    begin = end
+                else:
+                    raise ValueError("Книги нет в коллекции")
+
+                removed = end - begin
+                following = _Generation(self.path, generation.number + 1)
+                with open(following.data_path, "wb") as data:
+                    data.write(data_view[:begin])
+                    data.write(data_view[end:ends[count - 1]])
+                    data.flush()
+                    os.fsync(data.fileno())
+                with open(following.index_path, "wb") as index:
+                    index.write(index_view[:position * _OFFSET.size])
+                    for start in range(position + 1, count, _REWRITE_CHUNK):
+                        stop = min(start + _REWRITE_CHUNK, count)
+                        index.write(array("Q", [offset - removed for offset
+                                                in ends[start:stop]]))
+                    index.flush()
+                    os.fsync(index.fileno())
+
+            with self._map_lock:
+                self._write_manifest(following.number)
+                self._data.close()
+                self._index.close()
+                self._data = open(following.data_path, "ab")
+                self._index = open(following.index_path, "ab")
+                self._generation = following
+                self._size -= removed
+                self._count = count - 1
+                self._maps = (0, None, None, None)
+            generation.retire()
+
+    def _write_manifest(self, number):
+        """Атомарно записывает в path номер текущего поколения."""
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as manifest:
+            manifest.write(_MANIFEST.pack(number))
+            manifest.flush()
+            os.fsync(manifest.fileno())
+        os.replace(temporary, self.path)
+
+    def _mapped(self):
+        """
+        Отображения файлов, покрывающие все книги на текущий момент.
+
+        Старые отображения не закрываются явно: их могут использовать
+        другие читатели, и они освобождаются вместе с последней ссылкой.
+        """
+        maps = self._maps
+        if maps[0] < self._count:
+            with self._map_lock:
+                maps = self._maps
+                if maps[0] < self._count:
+                    maps = self._maps = self._map_files()
+        return maps
+
+    def _map_files(self):
+        count = self._count
+        data_map, index_map = self._generation.map()
+        return count, data_map, index_map, self._generation
+
+    def __len__(self):
+        return self._count
+
+    def _view(self):
+        if not self._count:
+            return _FileView(0, b"", b"")
+        return _FileView(*self._mapped())
+
+    def __getitem__(self, index):
+        return self._view()[index]
+
+    def snapshot(self):
+        view = self._view()
+        return BookSnapshot(view, len(view), page_size=self.page_size)
+
+    def _payload(self, view, start, stop):
+        # Снимок файловой коллекции - BookSnapshot над _FileView.
+        generation = view._books.generation
+        return _FileRange(self.path, generation.number, start,
+                          min(stop, len(view)))
+
+    def close(self):
+        self._maps = (0, None, None, None)
+        self._data.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 class BookIterator:
-    """Итератор для коллекции книг."""
+    """
+    Итератор для коллекции книг.
 
-    def __init__(self, books):
+    С page_size книги берутся срезами по page_size штук, так что
+    коллекция на диске читается постранично и в памяти только одна страница.
+    Итератор останавливается на stop (по умолчанию - длина books в момент
+    создания) и не видит книг, добавленных позже.
+    """
+
+    def __init__(self, books, page_size=None, stop=None):
         self._books = books
         self._index = 0
+        self._page_size = page_size
+        self._page = []
+        self._page_start = 0
+        self._stop = len(books) if stop is None else stop
     
     def __iter__(self):
         return self
     
     def __next__(self):
-        if self._index < len(self._books):
-            book = self._books[self._index]
-            self._index += 1
-            return book
-        raise StopIteration
+        if self._page_size is None:
+            if self._index < self._stop:
+                book = self._books[self._index]
+                self._index += 1
+                return book
+            raise StopIteration
+
+        offset = self._index - self._page_start
+        if offset >= len(self._page):
+            self._page_start = self._index
+            self._page = self._books[
+                self._index:min(self._index + self._page_size, self._stop)]
+            if not self._page:
+                raise StopIteration
+            offset = 0
+        self._index += 1
+        return self._page[offset]
+
+
+class BookStorage(ABC):
+    """Хранилище, из которого книги читаются страницами (например, удаленное)."""
+
+    @abstractmethod
+    async def size(self):
+        """Число книг в хранилище."""
+        pass
+
+    @abstractmethod
+    async def fetch(self, start, stop):
+        """Книги с номерами [start, stop)."""
+        pass
+
+
+class MemoryBookStorage(BookStorage):
+    """Хранилище в памяти с искусственной задержкой - замена удаленного."""
+
+    def __init__(self, books, latency=0.0):
+        self._books = list(books)
+        self.latency = latency
+
+    async def size(self):
+        return len(self._books)
+
+    async def fetch(self, start, stop):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._books[start:stop]
+
+
+class CollectionBookStorage(BookStorage):
+    """
+    Хранилище поверх снимка BookCollection.
+
+    Страницы читаются в отдельном потоке, поэтому медленный диск
+    файловой коллекции не блокирует цикл событий.
+    """
+
+    def __init__(self, collection):
+        self._view = collection.snapshot()
+
+    async def size(self):
+        return len(self._view)
+
+    async def fetch(self, start, stop):
+        return await asyncio.to_thread(self._view.__getitem__,
+                                       slice(start, stop))
+
+
+class AsyncBookIterator:
+    """
+    Асинхронный итератор с упреждающей загрузкой страниц.
+
+    Пока потребитель обрабатывает текущую страницу, в фоне уже
+    загружаются следующие prefetch страниц. ``async for`` не закрывает
+    итератор при выходе через break, поэтому обход с возможным
+    досрочным выходом оборачивают в ``async with``: на выходе
+    незавершенные загрузки отменяются, а их ошибки забираются.
+    """
+
+    def __init__(self, storage, page_size=256, prefetch=2):
+        if page_size < 1:
+            raise ValueError("Размер страницы должен быть положительным")
+        self._storage = storage
+        self._page_size = page_size
+        self._prefetch = prefetch
+        self._total = None
+        self._next_start = 0
+        self._pending = deque()
+        self._page = []
+        self._offset = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def _schedule(self):
+        # Текущая страница плюс prefetch страниц впереди.
+        while (len(self._pending) <= self._prefetch
+               and self._next_start < self._total):
+            stop = min(self._next_start + self._page_size, self._total)
+            self._pending.append(asyncio.ensure_future(
+                self._storage.fetch(self._next_start, stop)))
+            self._next_start = stop
+
+    async def __anext__(self):
+        if self._offset >= len(self._page):
+            if self._total is None:
+                self._total = await self._storage.size()
+            self._schedule()
+            if not self._pending:
+                raise StopAsyncIteration
+            try:
+                self._page = await self._pending.popleft()
+            except BaseException:
+                await self.aclose()
+                raise
+            self._offset = 0
+            if not self._page:
+                await self.aclose()
+                raise StopAsyncIteration
+        book = self._page[self._offset]
+        self._offset += 1
+        return book
+
+    async def aclose(self):
+        """Отменяет загрузки, которые уже не понадобятся, и дожидается их."""
+        pending, self._pending = list(self._pending), deque()
+        # Дальше итератор пуст, даже если его продолжат обходить.
+        self._total = self._next_start
+        self._page, self._offset = [], 0
+        for task in pending:
+            task.cancel()
+        # Ошибки отмененных загрузок забираются, чтобы не было
+        # предупреждений "exception was never retrieved".
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _consume(storage, prefetch, work=0.001, page_size=50):
+    start = time.perf_counter()
+    count = 0
+    async with AsyncBookIterator(storage, page_size=page_size,
+                                 prefetch=prefetch) as books:
+        async for _ in books:
+            count += 1
+            if count % page_size == 0:
+                # Обработка страницы занимает столько же, сколько ее загрузка.
+                await asyncio.sleep(work * page_size / 10)
+    return count, time.perf_counter() - start
+
+
+def benchmark_iteration(count=300000, chunk_size=1024):
+    """Сравнивает накладные расходы на книгу: итератор и chunks."""
+    library = BookCollection()
+    for i in range(count):
+        library.add_book(f"Книга №{i}")
+
+    def by_iterator():
+        for _ in library:
+            pass
+
+    def by_chunks():
+        for chunk in library.chunks(chunk_size):
+            for _ in chunk:
+                pass
+
+    for title, run in (("BookIterator", by_iterator), ("chunks", by_chunks)):
+        elapsed = min(timeit.repeat(run, number=1, repeat=3))
+        print(f"{title}: {elapsed / count * 1e9:.0f} нс на книгу")
+
+
+def benchmark_file_catalog(count=200000):
+    """Память при обходе файлового каталога и параллельный map."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog.books")
+        with FileBookCollection(path, page_size=4096) as catalog:
+            catalog.add_books(f"Книга №{i}" for i in range(count))
+        # Повторное открытие не читает каталог в память.
+        with FileBookCollection(path, page_size=4096) as catalog:
+            tracemalloc.start()
+            total = sum(1 for _ in catalog)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"Обход {total} книг, пик памяти {peak / 1024:.0f} КБ")
+
+            lengths = list(catalog.map_parallel(len, workers=2))
+            assert lengths == [len(book) for book in catalog]
+            total = sum(catalog.map_parallel(len, workers=2, ordered=False))
+            print(f"Суммарная длина названий: {total}")
+
+
+def benchmark_prefetch(count=500, latency=0.005):
+    storage = MemoryBookStorage((f"Том {i}" for i in range(count)),
+                                latency=latency)
+    for prefetch in (0, 2):
+        total, elapsed = asyncio.run(_consume(storage, prefetch))
+        print(f"prefetch={prefetch}: {total} книг за {elapsed * 1e3:.0f} мс")
 
 
 def main():
@@ -56,6 +662,58 @@ def main():
     for book in library:
         print(book)
 
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog.books")
+        with FileBookCollection(path, page_size=4096) as catalog:
+            catalog.add_books(f"Книга №{i}" for i in range(1000))
+            catalog.add_book("Мастер и Маргарита")
+        with FileBookCollection(path, page_size=4096) as catalog:
+            print(len(catalog), catalog[0], catalog[-1], catalog[10:13])
+            before_removal = catalog.snapshot()
+            catalog.remove_book("Книга №0")
+            print(f"После удаления: {len(catalog)} книг, первая - "
+                  f"'{catalog[0]}', в снимке - '{before_removal[0]}'")
+
+    # Писатель дописывает книги, пока читатель обходит коллекцию.
+    shelf = BookCollection()
+    for i in range(10000):
+        shelf.add_book(f"Том {i}")
+    iterator = iter(shelf)
+    writer = Thread(target=lambda: [shelf.add_book(f"Новый том {i}")
+                                    for i in range(5000)])
+    writer.start()
+    seen = sum(1 for _ in iterator)
+    writer.join()
+    print(f"Итератор увидел {seen} книг, в коллекции уже {len(shelf)}")
+
+    async def read_all():
+        return [book async for book in library]
+
+    print(asyncio.run(read_all()))
+
+    async def first_matching(prefix):
+        # При досрочном выходе async with отменяет загрузки впереди.
+        async with shelf.async_iter(page_size=100, prefetch=3) as books:
+            async for book in books:
+                if book.startswith(prefix):
+                    return book
+
+    print(asyncio.run(first_matching("Том 12")))
+
+    before_removal = shelf.snapshot()
+    shelf.remove_book("Том 0")
+    print(f"Снимок до удаления начинается с '{before_removal[0]}', "
+          f"коллекция - с '{shelf[0]}'")
+
+
+def run_benchmarks():
+    benchmark_iteration()
+    benchmark_file_catalog()
+    benchmark_prefetch()
+
 
 if __name__ == "__main__":
-    main()
+    if "--bench" in sys.argv:
+        run_benchmarks()
+    else:
+        main()
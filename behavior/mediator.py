@@ -25,6 +25,18 @@
 
 
 from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import inspect
+import multiprocessing
+import os
+import pickle
+import queue
+import sys
+import threading
+import time
+import traceback
+import zlib
 
 
 class Mediator(ABC):
@@ -34,21 +46,323 @@ class Mediator(ABC):
         pass
 
 
+class _Outbox:
+    """Буфер исходящих сообщений одного получателя."""
+
+    __slots__ = ("messages", "last_from", "started")
+
+    def __init__(self, started: float):
+        self.messages: List[object] = []
+        # Позиция последнего сообщения каждого отправителя в буфере.
+        self.last_from: Dict[object, int] = {}
+        self.started = started
+
+
 class ChatMediator(Mediator):
+    """
+    Рассылает сообщение всем участникам, кроме отправителя.
 
-    def __init__(self):
+    По умолчанию каждое сообщение сразу передается в recieve. Если
+    задан batch_size или flush_interval, сообщения копятся в буфере
+    получателя и уходят одним вызовом recieve_batch, когда буфер
+    заполнится или самое старое сообщение прождет flush_interval
+    секунд. Срок проверяется при каждом notify и по таймеру, который
+    взводится, пока есть ждущие сообщения, так что буфер уходит и
+    после того, как сообщения перестали приходить. С timer=False
+    срок проверяют вызовом poll(); flush() сбрасывает все буферы.
+    coalesce(previous, message) может слить новое сообщение с последним
+    ждущим сообщением того же отправителя: вернуть объединенное
+    сообщение или None, чтобы оставить оба. Порядок сообщений одного
+    отправителя сохраняется всегда: буферы и доставка защищены одной
+    блокировкой, поэтому таймер не обгонит сброс из notify.
+    """
+
+    def __init__(self, batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None,
+                 coalesce: Optional[Callable[[object, object], object]] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 timer: bool = True):
         self._users = []
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.coalesce = coalesce
+        self._clock = clock
+        # Порядок вставки совпадает с порядком started: так просроченные
+        # буферы всегда в начале словаря.
+        self._outboxes: Dict["User", _Outbox] = {}
+        # Повторно входимая: recieve_batch может сам отправить сообщение.
+        self._lock = threading.RLock()
+        self._use_timer = timer and flush_interval is not None
+        self._timer: Optional[threading.Timer] = None
     
     def add_user(self, user):
         self._users.append(user)
+
+    @property
+    def buffered(self) -> bool:
+        return self.batch_size is not None or self.flush_interval is not None
     
     def notify(self, sender, event, data):
         if event == "message":
-            for user in self._users:
-                if user != sender:
-                    user.recieve(data)
+            if not self.buffered:
+                for user in self._users:
+                    if user != sender:
+                        user.recieve(data)
+                return
+            with self._lock:
+                self._buffer(sender, data)
+
+    def _buffer(self, sender, data) -> None:
+        """Кладет сообщение в буферы получателей; вызывается под блокировкой."""
+        now = self._clock()
+        outboxes = self._outboxes
+        coalesce = self.coalesce
+        limit = self.batch_size
+        full = []
+        # Цикл развернут вручную: это горячий путь рассылки.
+        for user in self._users:
+            if user == sender:
+                continue
+            outbox = outboxes.get(user)
+            if outbox is None:
+                outbox = outboxes[user] = _Outbox(now)
+            messages = outbox.messages
+            if coalesce is not None:
+                index = outbox.last_from.get(sender)
+                if index is not None:
+                    merged = coalesce(messages[index], data)
+                    if merged is not None:
+                        messages[index] = merged
+                        continue
+                outbox.last_from[sender] = len(messages)
+            messages.append(data)
+            if limit is not None and len(messages) >= limit:
+                full.append(user)
+        for user in full:
+            self.flush(user)
+        self._flush_expired(now)
+        self._arm()
+
+    def _flush_expired(self, now: float) -> None:
+        if self.flush_interval is None:
+            return
+        expired = []
+        for user, outbox in self._outboxes.items():
+            if now - outbox.started < self.flush_interval:
+                break
+            expired.append(user)
+        for user in expired:
+            self.flush(user)
+
+    def _arm(self) -> None:
+        """Взводит таймер на срок самого старого буфера, если его еще нет."""
+        if not self._use_timer or self._timer is not None or not self._outboxes:
+            return
+        oldest = next(iter(self._outboxes.values()))
+        delay = max(0.0, oldest.started + self.flush_interval - self._clock())
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+            self._flush_expired(self._clock())
+            self._arm()
+
+    def poll(self) -> None:
+        """Сбрасывает буферы, чей срок flush_interval уже истек."""
+        with self._lock:
+            self._flush_expired(self._clock())
+
+    def flush(self, user=None) -> None:
+        """Сбрасывает буфер получателя или, без аргумента, все буферы."""
+        with self._lock:
+            if user is None:
+                for user in list(self._outboxes):
+                    self.flush(user)
+                return
+            # Буфер снимается до вызова: ответы из recieve_batch попадут
+            # в новый буфер, а не в тот, что сейчас доставляется.
+            outbox = self._outboxes.pop(user, None)
+            if outbox is not None and outbox.messages:
+                user.recieve_batch(outbox.messages)
+
+    def close(self) -> None:
+        """Останавливает таймер и доставляет все, что осталось в буферах."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._use_timer = False
+            self.flush()
+
+    def pending(self, user) -> int:
+        """Сколько сообщений ждет в буфере получателя."""
+        outbox = self._outboxes.get(user)
+        return len(outbox.messages) if outbox is not None else 0
     
 
+class AsyncChatMediator(Mediator):
+    """
+    Чат с комнатами (темами) и неблокирующей асинхронной доставкой.
+
+    Для каждой темы хранится индекс ее участников, так что сообщение
+    обходит только участников темы. notify лишь кладет сообщение во
+    входящую очередь, а задача рассылки раскладывает его по очередям
+    получателей. У каждого получателя своя ограниченная очередь и своя
+    задача доставки, поэтому медленный recieve задерживает только его.
+    Синхронный recieve выполняется в потоке, чтобы не блокировать цикл
+    событий.
+    Если очередь получателя полна, сообщение отбрасывается,
+    учитывается в ``dropped`` и передается в on_drop.
+    """
+
+    DEFAULT_TOPIC = "general"
+
+    def __init__(self, queue_size: int = 1000,
+                 on_drop: Optional[Callable[["User", object], None]] = None):
+        self.queue_size = queue_size
+        self.on_drop = on_drop
+        self._topics: Dict[str, Dict["User", None]] = {}
+        self._memberships: Dict["User", Set[str]] = {}
+        self._queues: Dict["User", asyncio.Queue] = {}
+        self._workers: Dict["User", asyncio.Task] = {}
+        self._inbox: Optional[asyncio.Queue] = None
+        self._fanout: Optional[asyncio.Task] = None
+        self.delivered = 0
+        self.dropped: Dict["User", int] = {}
+        # Отброшенные сообщения ушедших пользователей.
+        self._dropped_departed = 0
+        self.errors = 0
+
+    def add_user(self, user):
+        self.join(user, self.DEFAULT_TOPIC)
+
+    def join(self, user, topic: str) -> None:
+        """Добавляет пользователя в тему."""
+        self._topics.setdefault(topic, {})[user] = None
+        self._memberships.setdefault(user, set()).add(topic)
+        if user not in self._queues:
+            self._queues[user] = asyncio.Queue(maxsize=self.queue_size)
+            self.dropped[user] = 0
+            if self._inbox is not None:
+                self._start_worker(user)
+
+    def leave(self, user, topic: str) -> None:
+        members = self._topics.get(topic)
+        if members is not None:
+            members.pop(user, None)
+            if not members:
+                del self._topics[topic]
+        topics = self._memberships.get(user)
+        if topics is not None:
+            topics.discard(topic)
+            if not topics:
+                self._release(user)
+
+    def _release(self, user) -> None:
+        """Освобождает очередь и задачу доставки пользователя без тем."""
+        del self._memberships[user]
+        queue = self._queues.pop(user)
+        # Недоставленные сообщения выбрасываются; task_done нужен,
+        # чтобы уже ожидающий drain не завис на join этой очереди.
+        while not queue.empty():
+            queue.get_nowait()
+            queue.task_done()
+        worker = self._workers.pop(user, None)
+        if worker is not None:
+            worker.cancel()
+        self._dropped_departed += self.dropped.pop(user)
+
+    async def start(self) -> None:
+        """Запускает задачи рассылки и доставки в текущем цикле событий."""
+        self._inbox = asyncio.Queue()
+        self._fanout = asyncio.create_task(self._fan_out())
+        for user in self._queues:
+            self._start_worker(user)
+
+    def _start_worker(self, user) -> None:
+        self._workers[user] = asyncio.create_task(self._deliver(user))
+
+    def notify(self, sender, event, data):
+        if self._inbox is None:
+            raise RuntimeError("Посредник не запущен: вызовите start()")
+        if event == "message":
+            topics = tuple(self._memberships.get(sender, ()))
+            self._inbox.put_nowait((sender, topics, data))
+        elif event == "topic_message":
+            topic, message = data
+            self._inbox.put_nowait((sender, (topic,), message))
+
+    async def _fan_out(self) -> None:
+        while True:
+            sender, topics, message = await self._inbox.get()
+            try:
+                recipients: Dict["User", None] = {}
+                for topic in topics:
+                    recipients.update(self._topics.get(topic, {}))
+                recipients.pop(sender, None)
+                for user in recipients:
+                    try:
+                        self._queues[user].put_nowait(message)
+                    except asyncio.QueueFull:
+                        self.dropped[user] += 1
+                        if self.on_drop is not None:
+                            self.on_drop(user, message)
+            finally:
+                self._inbox.task_done()
+
+    async def _deliver(self, user) -> None:
+        queue = self._queues[user]
+        while True:
+            message = await queue.get()
+            try:
+                if inspect.iscoroutinefunction(user.recieve):
+                    await user.recieve(message)
+                else:
+                    result = await asyncio.to_thread(user.recieve, message)
+                    if inspect.isawaitable(result):
+                        await result
+                self.delivered += 1
+            except Exception:
+                # Ошибка одного получателя не останавливает его доставку.
+                self.errors += 1
+            finally:
+                queue.task_done()
+
+    def queue_depth(self, user) -> int:
+        """Сколько сообщений ждет доставки пользователю."""
+        return self._queues[user].qsize()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "inbox": self._inbox.qsize() if self._inbox is not None else 0,
+            "queued": sum(queue.qsize() for queue in self._queues.values()),
+            "delivered": self.delivered,
+            "dropped": sum(self.dropped.values()) + self._dropped_departed,
+            "errors": self.errors,
+        }
+
+    async def drain(self) -> None:
+        """Ждет, пока все отправленные сообщения будут доставлены."""
+        await self._inbox.join()
+        # Список, а не представление: пока ждем, пользователи могут
+        # присоединяться и уходить.
+        for queue in list(self._queues.values()):
+            await queue.join()
+
+    async def close(self) -> None:
+        """Доставляет оставшиеся сообщения и останавливает задачи."""
+        await self.drain()
+        tasks = [self._fanout, *self._workers.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = {}
+        self._inbox = self._fanout = None
+
+
 class User:
 
     def __init__(self, name, mediator: Mediator):
@@ -58,10 +372,247 @@ class User:
     def send(self, message):
         print(f"{self.name} отправляет {message}")
         self._mediator.notify(self, "message", message)
+
+    def send_to(self, topic, message):
+        """Отправляет сообщение только участникам темы."""
+        print(f"{self.name} отправляет в {topic}: {message}")
+        self._mediator.notify(self, "topic_message", (topic, message))
     
     def recieve(self, message):
         print(f"{self.name} получил {message}")
 
+    def recieve_batch(self, messages):
+        """Получает пачку сообщений; по умолчанию — по одному."""
+        for message in messages:
+            self.recieve(message)
+
+
+def shard_of(name: str, shards: int) -> int:
+    """Номер шарда пользователя; crc32 не зависит от PYTHONHASHSEED."""
+    return zlib.crc32(name.encode()) % shards
+
+
+class _Shard(Mediator):
+    """
+    Часть пользователей чата, живущая в одном процессе.
+
+    Для своих пользователей шард — обычный посредник: их сообщения
+    сразу доставляются соседям по шарду, а для остальных шардов
+    копятся в пачку, которая сериализуется один раз и рассылается
+    по всем ссылкам. sent и received считают пачки: по ним
+    ShardedChatMediator понимает, что в пути ничего не осталось.
+    """
+
+    def __init__(self, index: int, links: list, user_factory, batch_size: int):
+        self.index = index
+        self._links = links
+        self._factory = user_factory
+        self.batch_size = batch_size
+        self._users: Dict[str, User] = {}
+        self._outbox: List[Tuple[str, object]] = []
+        self.sent = 0
+        self.received = 0
+        self.delivered = 0
+
+    def notify(self, sender, event, data):
+        if event == "message":
+            self._deliver(sender.name, data)
+            self._outbox.append((sender.name, data))
+            if len(self._outbox) >= self.batch_size:
+                self.flush()
+
+    def _deliver(self, sender: str, message) -> None:
+        for name, user in self._users.items():
+            if name != sender:
+                user.recieve(message)
+                self.delivered += 1
+
+    def flush(self) -> None:
+        if not self._outbox:
+            return
+        payload = pickle.dumps(self._outbox, pickle.HIGHEST_PROTOCOL)
+        self._outbox = []
+        for index, link in enumerate(self._links):
+            if index != self.index:
+                link.put(("batch", payload))
+                self.sent += 1
+
+    def handle(self, item):
+        """Обрабатывает команду из очереди; возвращает ответ или None."""
+        kind, payload = item
+        if kind == "batch":
+            self.received += 1
+            for sender, message in pickle.loads(payload):
+                self._deliver(sender, message)
+        elif kind == "add":
+            self._users[payload] = self._factory(payload, self)
+        elif kind == "sync":
+            self.flush()
+            return "sync", self.index, self.sent, self.received
+        elif kind == "stop":
+            self.flush()
+            return "stats", self.index, {"users": len(self._users),
+                                         "delivered": self.delivered}
+        return None
+
+
+def _shard_main(index, links, results, user_factory, batch_size):
+    try:
+        shard = _Shard(index, links, user_factory, batch_size)
+        while True:
+            reply = shard.handle(links[index].get())
+            if reply is not None:
+                results.put(reply)
+                if reply[0] == "stats":
+                    return
+    except Exception:
+        # Исключение может не пережить pickle, поэтому передается текстом.
+        results.put(("error", index, traceback.format_exc()))
+
+
+class _LocalLink:
+    """Очередь-заглушка: сразу передает команду шарду в этом процессе."""
+
+    def __init__(self, replies: list):
+        self.shard: Optional[_Shard] = None
+        self._replies = replies
+
+    def put(self, item) -> None:
+        reply = self.shard.handle(item)
+        if reply is not None:
+            self._replies.append(reply)
+
+
+class ShardedChatMediator(Mediator):
+    """
+    Чат, разбитый на шарды по crc32 имени пользователя.
+
+    Каждый шард — отдельный процесс со своими пользователями, поэтому
+    рассылка большому числу участников идет на всех ядрах сразу.
+    Пользователи создаются внутри шарда через user_factory(name, shard),
+    так что снаружи к ним обращаются по имени. Сообщения, пришедшие
+    через send, копятся в пачки по batch_size и сериализуются один раз
+    на пачку. С processes=False шарды работают в текущем процессе —
+    для тестов и отладки, с той же сериализацией.
+
+    Если шард падает (исключение в user_factory или recieve) или его
+    процесс завершается, ближайший drain или close останавливает
+    остальные шарды и поднимает RuntimeError.
+    """
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, shards: Optional[int] = None, user_factory=User,
+                 batch_size: int = 256, processes: bool = True):
+        self.shards = shards or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self._outbox: List[Tuple[str, object]] = []
+        self.sent = 0
+        self._processes = []
+        self._error: Optional[RuntimeError] = None
+        if processes:
+            context = multiprocessing.get_context()
+            self._links = [context.Queue() for _ in range(self.shards)]
+            self._results = context.Queue()
+            for index in range(self.shards):
+                process = context.Process(
+                    target=_shard_main, daemon=True,
+                    args=(index, self._links, self._results,
+                          user_factory, batch_size))
+                process.start()
+                self._processes.append(process)
+        else:
+            self._replies = []
+            self._links = [_LocalLink(self._replies)
+                           for _ in range(self.shards)]
+            for index, link in enumerate(self._links):
+                link.shard = _Shard(index, self._links, user_factory,
+                                    batch_size)
+
+    def add_user(self, name: str) -> int:
+        """Создает пользователя в его шарде и возвращает номер шарда."""
+        index = shard_of(name, self.shards)
+        self._links[index].put(("add", name))
+        return index
+
+    def send(self, sender: str, message) -> None:
+        """Отправляет сообщение от имени пользователя всем остальным."""
+        self._outbox.append((sender, message))
+        if len(self._outbox) >= self.batch_size:
+            self.flush()
+
+    def notify(self, sender, event, data):
+        if event == "message":
+            self.send(getattr(sender, "name", sender), data)
+
+    def flush(self) -> None:
+        if not self._outbox:
+            return
+        payload = pickle.dumps(self._outbox, pickle.HIGHEST_PROTOCOL)
+        self._outbox = []
+        for link in self._links:
+            link.put(("batch", payload))
+        self.sent += self.shards
+
+    def _broadcast(self, kind: str) -> list:
+        if self._error is not None:
+            raise self._error
+        for link in self._links:
+            link.put((kind, None))
+        if not self._processes:
+            replies, self._replies[:] = list(self._replies), []
+            return replies
+        replies = []
+        while len(replies) < self.shards:
+            try:
+                reply = self._results.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                # Шард, вышедший штатно, успел положить ответ в очередь,
+                # поэтому ошибкой считается только ненулевой код выхода.
+                for index, process in enumerate(self._processes):
+                    if not process.is_alive() and process.exitcode:
+                        self._fail(f"Процесс шарда {index} завершился "
+                                   f"с кодом {process.exitcode}")
+                continue
+            if reply[0] == "error":
+                _, index, details = reply
+                self._fail(f"Шард {index} упал:\n{details}")
+            replies.append(reply)
+        return replies
+
+    def _fail(self, message: str) -> None:
+        """Останавливает все шарды и поднимает ошибку."""
+        self._error = RuntimeError(message)
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        raise self._error
+
+    def drain(self) -> None:
+        """
+        Ждет, пока не останется пачек в пути. Ответ пользователя из
+        recieve сам порождает пачки, поэтому опрос повторяется, пока два
+        раунда подряд не покажут одинаковые и равные счетчики.
+        """
+        previous = None
+        while True:
+            self.flush()
+            replies = self._broadcast("sync")
+            sent = self.sent + sum(reply[2] for reply in replies)
+            received = sum(reply[3] for reply in replies)
+            if sent == received and previous == (sent, received):
+                return
+            previous = sent, received
+
+    def close(self) -> Dict[int, dict]:
+        """Доставляет все сообщения, останавливает шарды и возвращает их статистику."""
+        self.drain()
+        stats = {index: data for _, index, data in self._broadcast("stop")}
+        for process in self._processes:
+            process.join()
+        return dict(sorted(stats.items()))
+
 
 def main():
     mediator = ChatMediator()
@@ -76,6 +627,162 @@ def main():
 
     alice.send("Всем привет!")
 
+    buffered_chat()
+    asyncio.run(async_chat())
+    sharded_chat()
+
+
+def buffered_chat():
+    print("\n=== Буферизованная доставка ===")
+    # Статусы одного отправителя сливаются: важен только последний.
+    mediator = ChatMediator(
+        batch_size=3,
+        coalesce=lambda old, new: new
+        if old.startswith("статус:") and new.startswith("статус:") else None)
+
+    alice = User("Alice", mediator)
+    bob = User("Bob", mediator)
+    mediator.add_user(alice)
+    mediator.add_user(bob)
+
+    alice.send("статус: печатает")
+    alice.send("статус: думает")
+    alice.send("Привет, Bob!")
+    print(f"В буфере Bob: {mediator.pending(bob)}")
+    alice.send("Как дела?")
+    bob.send("Отлично!")
+    mediator.flush()
+
+
+class SocketUser(User):
+    """
+    Пользователь за «сокетом»: каждый вызов — отдельная запись в
+    файловый дескриптор, как отправка по сети.
+    """
+
+    def __init__(self, name, mediator, fd):
+        super().__init__(name, mediator)
+        self._fd = fd
+        self.count = 0
+
+    def recieve(self, message):
+        os.write(self._fd, f"{message}\n".encode())
+        self.count += 1
+
+    def recieve_batch(self, messages):
+        os.write(self._fd, "".join(f"{m}\n" for m in messages).encode())
+        self.count += len(messages)
+
+
+class EchoUser(User):
+    """Отвечает на приветствие, чтобы показать отправку изнутри шарда."""
+
+    def recieve(self, message):
+        print(f"{self.name} получил {message}")
+        if message == "Всем привет!":
+            self.send(f"{self.name} здоровается в ответ")
+
+    def send(self, message):
+        self._mediator.notify(self, "message", message)
+
+
+class TallyUser(User):
+    """Пользователь без вывода: только считает сообщения."""
+
+    def __init__(self, name, mediator):
+        super().__init__(name, mediator)
+        self.count = 0
+
+    def recieve(self, message):
+        self.count += 1
+
+
+def sharded_chat():
+    print("\n=== Чат, разбитый на шарды ===")
+    mediator = ShardedChatMediator(shards=2, user_factory=EchoUser,
+                                   processes=False)
+    for name in ("Alice", "Bob", "Charlie"):
+        print(f"{name} -> шард {mediator.add_user(name)}")
+    mediator.send("Alice", "Всем привет!")
+    print(mediator.close())
+
+
+def benchmark_sharding(users=20000, messages=200):
+    print("\n=== Замер: рассылка по шардам ===")
+    variants = [("1 шард в этом процессе",
+                 dict(shards=1, processes=False))]
+    variants += [(f"{n} процесс(а)", dict(shards=n)) for n in (1, 2, 4)]
+    for label, options in variants:
+        mediator = ShardedChatMediator(user_factory=TallyUser, **options)
+        for i in range(users):
+            mediator.add_user(f"user{i}")
+        start = time.perf_counter()
+        for i in range(messages):
+            mediator.send(f"user{i}", i)
+        stats = mediator.close()
+        elapsed = time.perf_counter() - start
+        delivered = sum(shard["delivered"] for shard in stats.values())
+        print(f"{label}: {delivered} доставок за {elapsed:.3f} с")
+
+
+def benchmark_batching(users=200, messages=2000):
+    print("\n=== Замер: поштучная и пачечная доставка ===")
+    fd = os.open(os.devnull, os.O_WRONLY)
+    for label, mediator in (("поштучно", ChatMediator()),
+                            ("пачками по 64", ChatMediator(batch_size=64))):
+        members = [SocketUser(f"u{i}", mediator, fd) for i in range(users)]
+        for member in members:
+            mediator.add_user(member)
+        start = time.perf_counter()
+        for i in range(messages):
+            mediator.notify(members[i % users], "message", i)
+        mediator.flush()
+        elapsed = time.perf_counter() - start
+        delivered = sum(member.count for member in members)
+        print(f"{label}: {delivered} доставок за {elapsed:.3f} с")
+    os.close(fd)
+
+
+class SlowUser(User):
+    """Пользователь с медленным асинхронным получением."""
+
+    async def recieve(self, message):
+        await asyncio.sleep(0.01)
+        print(f"{self.name} (медленно) получил {message}")
+
+
+async def async_chat():
+    print("\n=== Асинхронный чат с темами ===")
+    mediator = AsyncChatMediator(
+        queue_size=2,
+        on_drop=lambda user, message: print(
+            f"Сообщение для {user.name} отброшено: {message}"))
+    await mediator.start()
+
+    alice = User("Alice", mediator)
+    bob = User("Bob", mediator)
+    dave = SlowUser("Dave", mediator)
+    for user in (alice, bob, dave):
+        mediator.add_user(user)
+    mediator.join(alice, "python")
+    mediator.join(dave, "python")
+
+    for i in range(4):
+        alice.send_to("python", f"новость №{i}")
+    alice.send("Всем привет!")
+    await asyncio.sleep(0)
+    print(f"Очередь Dave: {mediator.queue_depth(dave)}")
+    await mediator.close()
+    print(mediator.stats())
+
+
+def run_benchmarks():
+    benchmark_batching()
+    benchmark_sharding()
+
 
 if __name__ == "__main__":
-    main()
+    if "--bench" in sys.argv:
+        run_benchmarks()
+    else:
+        main()
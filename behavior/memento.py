@@ -14,41 +14,298 @@
 #     Опекуну нужно управлять жизненным циклом хранителей
 #     Дополнительные затраты на сериализацию/копирование данных
 
-from dataclasses import dataclass
-from typing import List
-from copy import deepcopy
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+import contextlib
+import io
+import random
+import sys
 import time
+import tracemalloc
 
 
 @dataclass
 class TextEditorMemento:
-    content: str
+    """
+    Снимок редактора: либо ключевой кадр с полным текстом, либо
+    разница с предыдущим снимком base — (start, end, text): участок
+    [start, end) текста base заменен на text. depth — сколько разниц
+    отделяет снимок от ближайшего ключевого кадра.
+    """
+
     cursor_position: int
     timestamp: float
+    length: int
+    keyframe: Optional[str] = None
+    base: Optional["TextEditorMemento"] = field(default=None, repr=False)
+    delta: Optional[Tuple[int, int, str]] = None
+    depth: int = 0
+
+    def _buffer(self) -> "PieceTable":
+        """Собирает текст из ключевого кадра и цепочки разниц."""
+        deltas, memento = [], self
+        while memento.keyframe is None:
+            deltas.append(memento.delta)
+            memento = memento.base
+        buffer = PieceTable(memento.keyframe)
+        for start, end, text in reversed(deltas):
+            buffer.delete(start, end)
+            buffer.insert(start, text)
+        return buffer
+
+    @property
+    def content(self) -> str:
+        return str(self._buffer())
 
     def get_snapshot_info(self) -> str:
         """Возвращает информацию о снимке."""
-        return f"Снимок от {time.ctime(self.timestamp)}: '{self.content[:20]}...'"
+        return f"Снимок от {time.ctime(self.timestamp)}: '{self._buffer().slice(0, 20)}...'"
+
+
+class _Piece:
+    """
+    Узел декартова дерева (treap) кусков: ссылка на участок чанка
+    и суммарная длина поддерева, по которой ищется позиция.
+    """
+
+    __slots__ = ("chunk", "start", "length", "size", "priority", "left", "right")
+
+    def __init__(self, chunk: int, start: int, length: int, priority: float):
+        self.chunk = chunk
+        self.start = start
+        self.length = length
+        self.size = length
+        self.priority = priority
+        self.left: Optional["_Piece"] = None
+        self.right: Optional["_Piece"] = None
+
+
+def _size(node: Optional[_Piece]) -> int:
+    return node.size if node is not None else 0
+
+
+def _update(node: _Piece) -> None:
+    node.size = _size(node.left) + node.length + _size(node.right)
+
+
+def _split(node: Optional[_Piece], k: int) -> Tuple[Optional[_Piece], Optional[_Piece]]:
+    """Делит дерево на первые k символов и остаток."""
+    if node is None:
+        return None, None
+    left_size = _size(node.left)
+    if k <= left_size:
+        left, node.left = _split(node.left, k)
+        _update(node)
+        return left, node
+    if k >= left_size + node.length:
+        node.right, right = _split(node.right, k - left_size - node.length)
+        _update(node)
+        return node, right
+    # Разрез внутри куска: правая половина наследует приоритет,
+    # поэтому свойство кучи не нарушается.
+    cut = k - left_size
+    tail = _Piece(node.chunk, node.start + cut, node.length - cut, node.priority)
+    tail.right, node.right = node.right, None
+    node.length = cut
+    _update(tail)
+    _update(node)
+    return node, tail
+
+
+def _merge(left: Optional[_Piece], right: Optional[_Piece]) -> Optional[_Piece]:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+class PieceTable:
+    """
+    Текстовый буфер — таблица кусков в декартовом дереве.
+
+    Текст не копируется при правке: исходная строка и все вставки
+    лежат в неизменяемых чанках, а дерево хранит куски-ссылки на них
+    в порядке следования. Вставка и удаление в любой позиции —
+    O(log n) по числу кусков. Подряд идущие вставки дописываются в
+    открытый чанк ограниченного размера и продлевают последний кусок,
+    поэтому посимвольный набор не плодит узлы. Полная строка
+    собирается лениво и кэшируется до следующей правки.
+    """
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self, text: str = ""):
+        self._chunks: List[str] = []
+        self._open: Optional[int] = None
+        self._root: Optional[_Piece] = None
+        self._text: Optional[str] = text
+        if text:
+            self._chunks.append(text)
+            self._root = _Piece(0, 0, len(text), random.random())
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = "".join(self._pieces())
+        return self._text
+
+    def slice(self, start: int, stop: int) -> str:
+        """Текст в диапазоне [start, stop) без сборки всей строки."""
+        if self._text is not None:
+            return self._text[start:stop]
+        parts: List[str] = []
+        self._collect(self._root, start, stop, parts)
+        return "".join(parts)
+
+    def _collect(self, node: Optional[_Piece], start: int, stop: int,
+                 parts: List[str]) -> None:
+        if node is None or start >= stop:
+            return
+        left_size = _size(node.left)
+        if start < left_size:
+            self._collect(node.left, start, min(stop, left_size), parts)
+        low = max(start - left_size, 0)
+        high = min(stop - left_size, node.length)
+        if low < high:
+            parts.append(self._chunks[node.chunk][node.start + low:node.start + high])
+        offset = left_size + node.length
+        if stop > offset:
+            self._collect(node.right, max(start - offset, 0), stop - offset, parts)
+
+    def _pieces(self):
+        chunks = self._chunks
+        stack, node = [], self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield chunks[node.chunk][node.start:node.start + node.length]
+            node = node.right
+
+    def _store(self, text: str) -> Tuple[int, int]:
+        """Кладет текст в чанк и возвращает (номер чанка, смещение)."""
+        if self._open is not None:
+            chunk = self._chunks[self._open]
+            if len(chunk) + len(text) <= self.CHUNK_SIZE:
+                self._chunks[self._open] = chunk + text
+                return self._open, len(chunk)
+        self._chunks.append(text)
+        self._open = len(self._chunks) - 1 if len(text) < self.CHUNK_SIZE else None
+        return len(self._chunks) - 1, 0
+
+    def _extend(self, position: int, chunk: int, start: int, length: int) -> bool:
+        """Продлевает кусок, кончающийся в position, если текст лег сразу за ним."""
+        path, node, k = [], self._root, position
+        while node is not None:
+            path.append(node)
+            left_size = _size(node.left)
+            if k <= left_size:
+                node = node.left
+            elif k <= left_size + node.length:
+                if (k != left_size + node.length or node.chunk != chunk
+                        or node.start + node.length != start):
+                    return False
+                node.length += length
+                for parent in path:
+                    parent.size += length
+                return True
+            else:
+                k -= left_size + node.length
+                node = node.right
+        return False
+
+    def insert(self, position: int, text: str) -> None:
+        if not text:
+            return
+        chunk, start = self._store(text)
+        self._text = None
+        if self._extend(position, chunk, start, len(text)):
+            return
+        left, right = _split(self._root, position)
+        piece = _Piece(chunk, start, len(text), random.random())
+        self._root = _merge(_merge(left, piece), right)
+
+    def append(self, text: str) -> None:
+        self.insert(len(self), text)
+
+    def delete(self, start: int, stop: int) -> None:
+        """Удаляет символы в диапазоне [start, stop)."""
+        if start >= stop:
+            return
+        self._text = None
+        left, rest = _split(self._root, start)
+        _, right = _split(rest, stop - start)
+        self._root = _merge(left, right)
 
 
 class TextEditor:
-    def __init__(self):
-        self._content = ""
+    """
+    Снимки хранят только разницу с предыдущим снимком (сохраненным
+    или восстановленным), а каждый keyframe_interval-й — полный текст.
+    Разница не ищется сравнением строк: правки сами сужают неизменные
+    префикс и суффикс, так что save стоит O(размер правок).
+    """
+
+    def __init__(self, keyframe_interval: int = 16):
+        self._content = PieceTable()
         self._cursor_position = 0
+        self.keyframe_interval = keyframe_interval
+        self._base: Optional[TextEditorMemento] = None
+        # (длина неизменного префикса, длина неизменного суффикса)
+        # относительно _base; None — правок не было.
+        self._dirty: Optional[Tuple[int, int]] = None
+
+    def _touch(self, start: int, stop: int) -> None:
+        tail = len(self._content) - stop
+        if self._dirty is None:
+            self._dirty = (start, tail)
+        else:
+            self._dirty = (min(self._dirty[0], start), min(self._dirty[1], tail))
+
+    def _insert(self, position: int, text: str) -> None:
+        self._touch(position, position)
+        self._content.insert(position, text)
+
+    def _delete(self, start: int, stop: int) -> None:
+        self._touch(start, stop)
+        self._content.delete(start, stop)
 
     def write(self, text: str) -> None:
         """Добавляет текст в редактор."""
-        self._content += text
+        self._insert(len(self._content), text)
         self._cursor_position = len(self._content)
         print(f"Записано: '{text}'")
 
+    def insert(self, text: str) -> None:
+        """Вставляет текст в позицию курсора."""
+        self._insert(self._cursor_position, text)
+        self._cursor_position += len(text)
+        print(f"Вставлено: '{text}'")
+
     def delete_last_char(self) -> None:
         """Удаляет последний символ."""
         if self._content:
-            self._content = self._content[:-1]
+            self._delete(len(self._content) - 1, len(self._content))
             self._cursor_position = len(self._content)
             print("Удален последний символ")
 
+    def backspace(self) -> None:
+        """Удаляет символ перед курсором."""
+        if self._cursor_position > 0:
+            self._delete(self._cursor_position - 1, self._cursor_position)
+            self._cursor_position -= 1
+            print("Удален символ перед курсором")
+
     def set_cursor(self, position: int) -> None:
         """Устанавливает позицию курсора."""
         if 0 <= position <= len(self._content):
@@ -57,21 +314,43 @@ class TextEditor:
 
     def save(self) -> TextEditorMemento:
         """Создает снимок текущего состояния."""
-        return TextEditorMemento(
-            content=deepcopy(self._content),
-            cursor_position=self._cursor_position,
-            timestamp=time.time()
-        )
+        base, length = self._base, len(self._content)
+        if base is None or base.depth + 1 >= self.keyframe_interval:
+            memento = TextEditorMemento(
+                cursor_position=self._cursor_position,
+                timestamp=time.time(),
+                length=length,
+                keyframe=str(self._content)
+            )
+        else:
+            if self._dirty is None:
+                delta = (0, 0, "")
+            else:
+                head, tail = self._dirty
+                delta = (head, base.length - tail,
+                         self._content.slice(head, length - tail))
+            memento = TextEditorMemento(
+                cursor_position=self._cursor_position,
+                timestamp=time.time(),
+                length=length,
+                base=base,
+                delta=delta,
+                depth=base.depth + 1
+            )
+        self._base, self._dirty = memento, None
+        return memento
 
     def restore(self, memento: TextEditorMemento) -> None:
         """Восстанавливает состояние из снимка."""
-        self._content = memento.content
+        self._content = memento._buffer()
         self._cursor_position = memento.cursor_position
+        self._base, self._dirty = memento, None
         print(f"Восстановлено состояние от {time.ctime(memento.timestamp)}")
 
     def __str__(self) -> str:
         """Отображает текущее состояние редактора."""
-        display = self._content[:self._cursor_position] + "|" + self._content[self._cursor_position:]
+        content = str(self._content)
+        display = content[:self._cursor_position] + "|" + content[self._cursor_position:]
         return f"Редактор: '{display}'"
 
 
@@ -156,6 +435,76 @@ def main():
     history.save_state()
     history.show_history()
 
+    print("\n=== Правка в позиции курсора ===")
+    editor.set_cursor(6)
+    editor.insert(" дорогой")
+    editor.backspace()
+    print(editor)
+
+
+def benchmark_buffer(size=4_000_000, edits=20000):
+    print("\n=== Замер: строка и таблица кусков ===")
+    document = "x" * size
+    rng = random.Random(1)
+    positions = [rng.randrange(size) for _ in range(edits)]
+
+    start = time.perf_counter()
+    text = document
+    for i, position in enumerate(positions[:edits // 20]):
+        if i % 2:
+            text = text[:position] + text[position + 1:]
+        else:
+            text = text[:position] + "y" + text[position:]
+    elapsed = time.perf_counter() - start
+    print(f"str, {edits // 20} правок в {size // 1_000_000} МБ: {elapsed:.3f} с")
+
+    start = time.perf_counter()
+    buffer = PieceTable(document)
+    for i, position in enumerate(positions):
+        if i % 2:
+            buffer.delete(position, position + 1)
+        else:
+            buffer.insert(position, "y")
+    for _ in range(edits):
+        buffer.append("z")
+    elapsed = time.perf_counter() - start
+    print(f"PieceTable, {edits * 2} правок: {elapsed:.3f} с")
+
+    start = time.perf_counter()
+    str(buffer)
+    print(f"Сборка строки: {time.perf_counter() - start:.3f} с")
+
+
+def benchmark_history(size=200_000, saves=200):
+    print("\n=== Замер: полные снимки и разницы ===")
+    for interval in (1, 16):
+        editor = TextEditor(keyframe_interval=interval)
+        history = EditorHistory(editor)
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            editor.write("x" * size)
+            for i in range(saves):
+                editor.set_cursor(i * 97 % size)
+                editor.insert("правка")
+                history.save_state()
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            start = time.perf_counter()
+            for _ in range(saves - 1):
+                history.undo()
+            elapsed = time.perf_counter() - start
+        label = "полные снимки" if interval == 1 else f"ключевой кадр раз в {interval}"
+        print(f"{label}: {memory / 2 ** 20:.1f} МБ на {saves} снимков, "
+              f"{saves - 1} отмен за {elapsed:.3f} с")
+
+
+def run_benchmarks():
+    benchmark_buffer()
+    benchmark_history()
+
 
 if __name__ == "__main__":
-    main()
+    if "--bench" in sys.argv:
+        run_benchmarks()
+    else:
+        main()